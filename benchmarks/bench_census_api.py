@@ -0,0 +1,75 @@
+"""
+Benchmarks CensusApi.get_table against a local stub of the census api, 
+comparing sequential and concurrent block requests.
+
+    python -m benchmarks.bench_census_api --blocks 20000 --latency 0.2
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from util.census_helpers import CensusApi
+
+
+def make_handler(blocks_per_county, latency):
+    class StubCensusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            variables = query['get'][0].split(',')
+            in_predicates = dict(p.split(':') for p in query.get('in', []))
+            state = in_predicates.get('state', '53')
+            counties = in_predicates.get('county', '033').split(',')
+
+            rows = [variables + ['state', 'county', 'tract', 'block']]
+            for county in counties:
+                for i in range(blocks_per_county):
+                    tract, block = f'{i // 1000:06d}', f'{i % 1000:04d}'
+                    geo_id = f'1000000US{state}{county}{tract}{block}'
+                    values = [geo_id if v == 'GEO_ID' else f'Block {block}' if v == 'NAME' else str(i % 97)
+                              for v in variables]
+                    rows.append(values + [state, county, tract, block])
+
+            # simulated server time grows with the size of the response
+            time.sleep(latency * len(counties))
+            body = json.dumps(rows).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubCensusHandler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--blocks', type=int, default=20000, help='blocks per county')
+    parser.add_argument('--latency', type=float, default=0.2, help='stub server seconds per county')
+    parser.add_argument('--variables', type=int, default=60, help='number of census variables')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(args.blocks, args.latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host = f'http://127.0.0.1:{server.server_port}'
+
+    variables = ['GEO_ID', 'NAME'] + [f'P1_{i:03d}N' for i in range(1, args.variables + 1)]
+    in_predicates = CensusApi.create_in_predicates('block', [53033, 53035, 53053, 53061], 53)
+
+    for workers in [1, 4, 8]:
+        c = CensusApi('stub', max_workers=workers, host=host)
+        start = time.perf_counter()
+        df = c.get_table(variables, 2020, 'block:*', in_predicates, 'dec/pl')
+        elapsed = time.perf_counter() - start
+        print(f'max_workers={workers}: {len(df)} rows x {len(df.columns)} columns in {elapsed:.2f}s')
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Measures the import time of run.py and every step module in a fresh
+interpreter, and which heavy dependencies each one loads.
+
+    python -m benchmarks.bench_imports --repeat 5
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+
+# dependencies that only spatial, census or database code paths should load
+HEAVY_MODULES = ['geopandas', 'shapely', 'pyproj', 'requests', 'sqlalchemy', 'pyodbc', 'pyarrow']
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def time_import(module, repeat):
+    # fastest of several imports of a module, each in a new interpreter
+    runs = []
+    for _ in range(repeat):
+        code = PROBE.format(module=module, heavy=HEAVY_MODULES)
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+        if result.returncode != 0:
+            return {'module': module, 'error': result.stderr.strip().splitlines()[-1]}
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    best = min(runs, key=lambda r: r['seconds'])
+    return {'module': module, 'seconds': round(best['seconds'], 4), 'loaded': best['loaded']}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5, help='imports per module, the fastest is reported')
+    parser.add_argument('--json', help='optional path to write the results to')
+    args = parser.parse_args()
+
+    modules = ['run'] + sorted(
+        f"steps.{os.path.splitext(os.path.basename(path))[0]}" for path in glob.glob('steps/*.py')
+    )
+    results = [time_import(module, args.repeat) for module in modules]
+
+    print(f"{'module':<40}{'seconds':>10}  heavy dependencies loaded")
+    for r in results:
+        if 'error' in r:
+            print(f"{r['module']:<40}{'failed':>10}  {r['error']}")
+        else:
+            print(f"{r['module']:<40}{r['seconds']:>10.3f}  {', '.join(r['loaded']) or '-'}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Times every pipeline step on synthetic inputs at several scales and records
+peak memory and throughput (blocks per second). Results are saved to
+benchmarks/results/<commit>.json so runs can be compared across commits.
+
+    python -m benchmarks.bench_steps --scales 1 10 100
+    python -m benchmarks.bench_steps --scales 1 --compare benchmarks/results/<other commit>.json
+"""
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import yaml
+
+from benchmarks.synthetic_data import generate, start_census_stub
+from util.elmer_helpers import dispose_engines
+
+
+RESULTS_DIR = 'benchmarks/results'
+
+
+def get_commit():
+    # short hash of the checked out commit, with a suffix if there are uncommitted changes
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f'{commit}-dirty' if dirty else commit
+
+
+def get_peak_rss_mb():
+    # peak resident set size of the process so far (ru_maxrss is KB on linux, bytes on macos)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+
+def run_step_timed(step_name, configs_dir, trace_memory):
+    """
+    Runs one step with --force semantics and returns its wall time, cpu time
+    and peak traced memory (MB, None if not traced).
+    """
+    run_step = importlib.import_module(step_name).run_step
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    run_step({'configs_dir': configs_dir, 'force': True})
+    seconds = time.perf_counter() - start
+    cpu_seconds = time.process_time() - cpu_start
+    peak_mb = None
+    if trace_memory:
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+    return seconds, cpu_seconds, peak_mb
+
+
+def bench_scale(scale, work_dir, trace_memory, seed):
+    out_dir = f"{work_dir}/scale_{scale}"
+    print(f"\nGenerating synthetic inputs at scale {scale} in {out_dir}...")
+    start = time.perf_counter()
+    configs_dir, summary = generate(out_dir, scale=scale, seed=seed)
+    print(f"{summary} in {time.perf_counter() - start:.1f}s")
+
+    server = start_census_stub(configs_dir)
+    with open(f"{configs_dir}/settings.yaml", 'r') as file:
+        step_names = yaml.safe_load(file)['steps']
+
+    results = []
+    try:
+        for step_name in step_names:
+            seconds, cpu_seconds, peak_mb = run_step_timed(step_name, configs_dir, trace_memory)
+            results.append({
+                'scale': scale,
+                'step': step_name,
+                'seconds': round(seconds, 3),
+                'cpu_seconds': round(cpu_seconds, 3),
+                'peak_traced_mb': round(peak_mb, 1) if peak_mb is not None else None,
+                'peak_rss_mb': round(get_peak_rss_mb(), 1),
+                'blocks_per_second': round(summary['blocks'] / seconds, 1) if seconds > 0 else None,
+                **{key: summary[key] for key in ['blocks', 'control_areas', 'targets']},
+            })
+    finally:
+        server.shutdown()
+        # engines are pooled by database name, the next scale uses a different sqlite file
+        dispose_engines()
+    return results
+
+
+def print_results(results, previous=None):
+    # one row per scale and step, with the change from previous results if given
+    previous = {(r['scale'], r['step']): r for r in previous or []}
+    print(f"\n{'scale':>6}  {'step':<40}{'seconds':>10}{'peak MB':>10}{'blocks/s':>12}"
+          + (f"{'vs prev':>10}" if previous else ''))
+    for r in results:
+        peak = r['peak_traced_mb'] if r['peak_traced_mb'] is not None else float('nan')
+        line = (f"{r['scale']:>6}  {r['step']:<40}{r['seconds']:>10.2f}{peak:>10.1f}"
+                f"{r['blocks_per_second'] or 0:>12.0f}")
+        prev = previous.get((r['scale'], r['step']))
+        if prev and prev['seconds'] > 0:
+            line += f"{r['seconds'] / prev['seconds']:>9.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100],
+                        help='size multipliers, 1 is roughly region scale')
+    parser.add_argument('--steps', nargs='+', help='only time these steps (all are still run in order)')
+    parser.add_argument('--work-dir', default='benchmarks/work', help='directory for the synthetic inputs and stores')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-trace-memory', action='store_true',
+                        help="don't trace python allocations (faster, peak_traced_mb is not recorded)")
+    parser.add_argument('--compare', help='results json from another commit to compare with')
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scales:
+        # steps depend on each other's outputs, so every step runs and --steps only filters the report
+        scale_results = bench_scale(scale, args.work_dir, not args.no_trace_memory, args.seed)
+        if args.steps:
+            scale_results = [r for r in scale_results if r['step'].split('.')[-1] in args.steps]
+        results += scale_results
+
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            previous = json.load(file)['results']
+    print_results(results, previous)
+
+    commit = get_commit()
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = f"{RESULTS_DIR}/{commit}.json"
+    with open(path, 'w') as file:
+        json.dump({
+            'commit': commit,
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'seed': args.seed,
+            'results': results,
+        }, file, indent=1)
+    print(f"\nSaved results to {path}")
+
+
+if __name__ == '__main__':
+    main()
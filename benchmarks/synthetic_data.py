@@ -0,0 +1,359 @@
+"""
+Builds synthetic region scale inputs for every pipeline step, so the whole
+pipeline can run without Elmer, ElmerGeo or the census api:
+
+- an sqlite database standing in for Elmer and ElmerGeo (control areas and
+  blocks with WKB polygons, ofm block estimates)
+- block level decennial data, served by a local stub of the census api
+- the csv inputs (control to target lookup, growth targets, employment, REF projection)
+- a settings.yaml pointing the pipeline at all of the above
+
+Scale 1 is roughly the size of the region (50,000 blocks, 155 target areas),
+every table grows linearly with the scale.
+
+    python -m benchmarks.synthetic_data --out benchmarks/work/scale_1 --scale 1
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+import shapely
+import yaml
+
+
+BLOCKS_PER_COUNTY = 12500 # at scale 1
+TARGETS_PER_COUNTY = 39 # at scale 1
+BLOCKS_PER_CONTROL_AREA = 121 # control areas are 11 x 11 block squares
+BLOCK_SIZE = 500 # feet
+WATER_SHARE = 0.01 # share of control area cells left empty, their blocks use the nearest control area
+OFM_EXTRA_COLS = 20 # ofm tables are read with select *, so they carry extra columns
+
+
+def get_block_ids(state_id, county_id, n_blocks):
+    # block geoids as built by the census api stub: state, county, 6 digit tract, 4 digit block
+    i = np.arange(n_blocks, dtype='int64')
+    county = int(str(county_id)[-3:])
+    return (int(state_id) * 10 ** 13 + county * 10 ** 10 + (i // 1000) * 10 ** 4 + i % 1000)
+
+
+def make_blocks(settings, scale, rng):
+    """
+    Returns the blocks of every county as a dataframe with geoid, county_id,
+    the block polygon and decennial and ofm values. Blocks are squares on one
+    grid covering the region.
+    """
+    county_ids = settings['county_ids']
+    n_per_county = BLOCKS_PER_COUNTY * scale
+    blocks = pd.concat([
+        pd.DataFrame({'geoid': get_block_ids(settings['state_id'], county_id, n_per_county),
+                      'county_id': county_id})
+        for county_id in county_ids
+    ], ignore_index=True)
+
+    n = len(blocks)
+    ncols = math.ceil(math.sqrt(n))
+    col = np.arange(n) % ncols
+    row = np.arange(n) // ncols
+    blocks['col'] = col
+    blocks['row'] = row
+    blocks['geometry'] = shapely.box(col * BLOCK_SIZE, row * BLOCK_SIZE,
+                                     (col + 1) * BLOCK_SIZE, (row + 1) * BLOCK_SIZE)
+
+    # decennial values
+    units = rng.poisson(20, n)
+    hh = rng.binomial(units, 0.93)
+    hhpop = np.rint(hh * rng.uniform(1.8, 3.2, n)).astype('int64')
+    gq = np.where(rng.random(n) < 0.02, rng.poisson(60, n), 0)
+    blocks['dec_units'] = units
+    blocks['dec_hh'] = hh
+    blocks['dec_gq'] = gq
+    blocks['dec_total_pop'] = hhpop + gq
+    return blocks
+
+
+def make_control_areas(blocks, n_targets, rng):
+    """
+    Returns control areas as squares of BLOCKS_PER_CONTROL_AREA blocks, with a
+    few cells left empty as water, and the control area of each block.
+    """
+    k = int(math.sqrt(BLOCKS_PER_CONTROL_AREA))
+    cell = (blocks['row'] // k) * (blocks['col'].max() // k + 1) + blocks['col'] // k
+    cells = (
+        pd.DataFrame({'cell': cell, 'row': blocks['row'] // k, 'col': blocks['col'] // k,
+                      'county_id': blocks['county_id']})
+        .groupby('cell').first().reset_index()
+    )
+    cells = cells[rng.random(len(cells)) >= WATER_SHARE].reset_index(drop=True)
+    cells['control_id'] = np.arange(1, len(cells) + 1)
+    cells['control_na'] = 'Control Area ' + cells['control_id'].astype(str)
+    size = k * BLOCK_SIZE
+    cells['geometry'] = shapely.box(cells['col'] * size, cells['row'] * size,
+                                    (cells['col'] + 1) * size, (cells['row'] + 1) * size)
+
+    # assign neighbouring control areas to target areas in the same county,
+    # every target area gets at least one control area
+    targets = []
+    next_id = 1
+    for county_id, df in cells.groupby('county_id', sort=False):
+        n = min(n_targets, len(df))
+        cells.loc[df.index, 'target_id'] = next_id + np.arange(len(df)) * n // len(df)
+        targets.append(pd.DataFrame({'target_id': np.arange(next_id, next_id + n), 'county_id': county_id}))
+        next_id += n
+    cells['target_id'] = cells['target_id'].astype('int64')
+    return cells, pd.concat(targets, ignore_index=True)
+
+
+def make_ofm_estimates(blocks, year, base_year, rng):
+    # ofm block estimates, grown or shrunk from the decennial values by year
+    factor = 1 + 0.015 * (int(year) - int(base_year))
+    n = len(blocks)
+    df = pd.DataFrame({
+        'block_geoid': blocks['geoid'].to_numpy(),
+        'housing_units': np.rint(blocks['dec_units'] * factor).astype('int64'),
+        'occupied_housing_units': np.rint(blocks['dec_hh'] * factor).astype('int64'),
+        'group_quarters_population': blocks['dec_gq'].to_numpy(),
+        'household_population': np.rint((blocks['dec_total_pop'] - blocks['dec_gq']) * factor).astype('int64'),
+    })
+    for i in range(OFM_EXTRA_COLS):
+        df[f'extra_{i:02d}'] = rng.random(n)
+    df['county_name'] = blocks['county_id'].astype(str).to_numpy()
+    return df
+
+
+def write_elmer_db(path, settings, blocks, control_areas, ofm_tables):
+    # sqlite stand-in for Elmer and ElmerGeo, geometries are stored as WKB
+    if os.path.exists(path):
+        os.remove(path)
+    geo_tables = {table['name']: table for table in settings['ElmerGeo']}
+    with sqlite3.connect(path) as con:
+        ca = geo_tables['control_areas']
+        pd.DataFrame({
+            'control_id': control_areas['control_id'],
+            'control_na': control_areas['control_na'],
+            'county_id': control_areas['county_id'],
+            'geometry': shapely.to_wkb(control_areas['geometry'].to_numpy()),
+        }).to_sql(ca['sql_table'], con, index=False)
+
+        blk = geo_tables['blocks']
+        pd.DataFrame({
+            blk['id_col']: blocks['geoid'],
+            'geometry': shapely.to_wkb(blocks['geometry'].to_numpy()),
+        }).to_sql(blk['sql_table'], con, index=False, chunksize=100000)
+
+        for table in settings['Elmer']:
+            ofm_tables[table['name']].to_sql(table['sql_table'], con, index=False, chunksize=100000)
+
+
+def write_csv_inputs(data_dir, settings, blocks, control_areas, targets, rng):
+    # control to target lookup
+    targets['RGID'] = rng.integers(1, 7, len(targets))
+    lookup = control_areas[['control_id', 'control_na', 'target_id']].merge(targets, on='target_id')
+    # like the real lookup, some control areas (rural areas, military bases) have no target.
+    # every target keeps its first control area, so each target still has block data
+    candidates = np.flatnonzero(lookup.groupby('target_id').cumcount().to_numpy() > 0)
+    if len(candidates):
+        no_target = rng.choice(candidates, max(len(candidates) // 50, 1), replace=False)
+        lookup.loc[lookup.index[no_target], 'target_id'] = np.nan
+    lookup.rename(columns={'control_na': 'name'})[['control_id', 'name', 'target_id', 'RGID', 'county_id']].to_csv(
+        f"{data_dir}/control_target_lookup.csv", index=False)
+
+    data_tables = {table['name']: table for table in settings['data_tables']}
+    for name, table in data_tables.items():
+        if re.match(r'employment_\d{4}_by_control_area', name):
+            emp = rng.poisson(300, len(control_areas))
+            pd.DataFrame({
+                'control_id': control_areas['control_id'],
+                'TotEmp': emp + rng.poisson(20, len(control_areas)),
+                table['no_mil_res_con_col']: emp,
+            }).to_csv(f"{data_dir}/{table['file']}", index=False)
+
+    # REF projection, grown from the regional decennial totals
+    total_pop = blocks['dec_total_pop'].sum()
+    gq = blocks['dec_gq'].sum()
+    hh = blocks['dec_hh'].sum()
+    years = [str(settings['base_year'] - 3), str(settings['targets_end_year']), str(settings['end_year'])]
+    growth = np.array([0.97, 1.35, 1.43])
+    ref = pd.DataFrame({'variable': ['Tot Pop', 'HH Pop', 'GQ Pop', 'HH']})
+    ref[years] = np.rint(np.outer([total_pop, total_pop - gq, gq, hh], growth)).astype('int64')
+    ref.to_csv(f"{data_dir}/{data_tables['ref_projection']['file']}", index=False)
+
+    # growth targets tables, one per county in the same order as county_ids
+    for county_id, table in zip(settings['county_ids'], settings['targets_tables']):
+        df = targets.loc[targets['county_id'] == county_id, ['target_id']].copy()
+        df['name'] = 'Target Area ' + df['target_id'].astype(str)
+        for col in ['units_chg_col', 'total_pop_chg_col', 'emp_chg_col']:
+            if col in table:
+                df[table[col]] = rng.integers(0, 20000, len(df))
+        if table['name'] == 'kitsap_targets':
+            # like the real file, Kitsap's employment targets are fractional
+            df[table['emp_chg_col']] = df[table['emp_chg_col']] + rng.integers(0, 4, len(df)) / 4
+        df.to_csv(f"{data_dir}/{table['file']}", index=False)
+
+
+def write_settings(out_dir, settings, blocks):
+    # settings.yaml for the synthetic inputs, based on configs/settings.yaml
+    settings = dict(settings)
+    settings['data_dir'] = f"{out_dir}/data"
+    settings['output_dir'] = f"{out_dir}/output"
+    settings.pop('census_cache', None)
+    db_url = f"sqlite:///{out_dir}/data/elmer.db"
+    settings['elmer_connections'] = {'Elmer': db_url, 'ElmerGeo': db_url}
+    settings['ElmerGeo'] = [dict(table, geometry_expr='geometry') for table in settings['ElmerGeo']]
+    settings['Elmer'] = [dict(table, sql_table=table['sql_table'].replace('.', '_'))
+                         for table in settings['Elmer']]
+    # outputs are loaded back into the same sqlite database
+    settings['output_table_list'] = [dict(table, sql_table=f"output_{table['name']}")
+                                     for table in settings.get('output_table_list', [])]
+    king = blocks['county_id'] == settings['county_ids'][0]
+    settings['king_hhpop_2044'] = int((blocks.loc[king, 'dec_total_pop'] - blocks.loc[king, 'dec_gq']).sum() * 1.3)
+    settings['steps'] = [
+        'steps.get_elmer_data',
+        'steps.get_census_data',
+        'steps.load_data',
+        'steps.block_control_xwalk',
+        'steps.prepare_block_data',
+        'steps.adjust_targets_to_base_year',
+        'steps.units_chg_targets',
+        'steps.total_pop_chg_targets',
+        'steps.extrapolate_to_controls_year',
+        'steps.export_outputs',
+    ]
+    os.makedirs(f"{out_dir}/configs", exist_ok=True)
+    with open(f"{out_dir}/configs/settings.yaml", 'w') as file:
+        yaml.safe_dump(settings, file, sort_keys=False)
+    return settings
+
+
+def generate(out_dir, scale=1, seed=0, settings_path='configs'):
+    """
+    Writes synthetic inputs and a settings.yaml for them to out_dir.
+    Returns the configs directory to run the pipeline with and a summary
+    of the generated tables.
+
+    Parameters
+    ----------
+    out_dir: directory to write to
+
+    scale: size multiplier, 1 is roughly region scale
+
+    seed: random seed, the same seed and scale always give the same inputs
+
+    settings_path: directory of the settings.yaml the synthetic settings are based on
+    """
+    out_dir = os.path.abspath(out_dir)
+    rng = np.random.default_rng(seed)
+    with open(f"{settings_path}/settings.yaml", 'r') as file:
+        settings = yaml.safe_load(file)
+    os.makedirs(f"{out_dir}/data", exist_ok=True)
+
+    blocks = make_blocks(settings, scale, rng)
+    control_areas, targets = make_control_areas(blocks, TARGETS_PER_COUNTY * scale, rng)
+    base_year = settings['base_year']
+    ofm_tables = {table['name']: make_ofm_estimates(blocks, table['name'].split('_')[-1], base_year, rng)
+                  for table in settings['Elmer']}
+
+    settings = write_settings(out_dir, settings, blocks)
+    write_elmer_db(f"{out_dir}/data/elmer.db", settings, blocks, control_areas, ofm_tables)
+    write_csv_inputs(f"{out_dir}/data", settings, blocks, control_areas, targets, rng)
+
+    # block values the census api stub serves
+    census_cols = {code: name for name, codes in settings['census_variables'].items() for code in codes}
+    census = blocks[['geoid'] + list(census_cols.values())]
+    census.to_pickle(f"{out_dir}/data/census_blocks.pkl")
+
+    summary = {'scale': scale, 'seed': seed, 'blocks': len(blocks), 'control_areas': len(control_areas),
+               'targets': len(targets)}
+    with open(f"{out_dir}/synthetic_data.json", 'w') as file:
+        json.dump(summary, file, indent=1)
+    return f"{out_dir}/configs", summary
+
+
+def make_census_handler(census, census_cols):
+    """
+    Returns a request handler that answers census api block queries from
+    the synthetic block table.
+
+    census: dataframe of geoid and decennial columns
+    census_cols: dictionary of census variable code to decennial column
+    """
+    geoid = census['geoid'].astype(str)
+    by_county = {county: df for county, df in census.assign(
+        state=geoid.str[:2], county=geoid.str[2:5], tract=geoid.str[5:11], block=geoid.str[11:]
+    ).groupby('county')}
+
+    class StubCensusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            variables = query['get'][0].split(',')
+            in_predicates = dict(p.split(':') for p in query.get('in', []))
+            counties = in_predicates.get('county', '').split(',')
+
+            rows = [variables + ['state', 'county', 'tract', 'block']]
+            for county in counties:
+                df = by_county.get(county)
+                if df is None:
+                    continue
+                cols = []
+                for v in variables:
+                    if v == 'GEO_ID':
+                        cols.append(('1000000US' + df['geoid'].astype(str)).tolist())
+                    elif v == 'NAME':
+                        cols.append(('Block ' + df['block']).tolist())
+                    else:
+                        cols.append(df[census_cols[v]].astype(str).tolist())
+                cols += [df['state'].tolist(), df['county'].tolist(), df['tract'].tolist(), df['block'].tolist()]
+                rows.extend(map(list, zip(*cols)))
+
+            body = json.dumps(rows).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubCensusHandler
+
+
+def start_census_stub(configs_dir):
+    """
+    Starts the census api stub for the synthetic blocks of a generated settings.yaml
+    on a local port and points census_host at it. Returns the server (call shutdown() when done).
+    """
+    with open(f"{configs_dir}/settings.yaml", 'r') as file:
+        settings = yaml.safe_load(file)
+    census = pd.read_pickle(f"{settings['data_dir']}/census_blocks.pkl")
+    census_cols = {code: name for name, codes in settings['census_variables'].items() for code in codes}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_census_handler(census, census_cols))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    settings['census_host'] = f'http://127.0.0.1:{server.server_port}'
+    with open(f"{configs_dir}/settings.yaml", 'w') as file:
+        yaml.safe_dump(settings, file, sort_keys=False)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out', default='benchmarks/work/scale_1', help='directory to write to')
+    parser.add_argument('--scale', type=int, default=1, help='size multiplier, 1 is roughly region scale')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    configs_dir, summary = generate(args.out, args.scale, args.seed)
+    print(f"Wrote synthetic inputs to {args.out}: {summary}")
+    print(f"Settings are in {configs_dir}, the census step needs census_host set to a "
+          f"running stub (see benchmarks/bench_steps.py)")
+
+
+if __name__ == '__main__':
+    main()
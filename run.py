@@ -1,6 +1,9 @@
 import argparse
 import sys
 from pypyr import pipelinerunner
+from util.pipeline import Pipeline, enable_copy_on_write
+from util.scheduler import run_steps_parallel
+from util.profiling import RunReport
 
 
 def add_run_args(parser):
@@ -12,11 +15,70 @@ def add_run_args(parser):
         default="configs",
         help="path to configs dir that contains settings.yaml (default: configs)",
     )
+    parser.add_argument(
+        "--from-step",
+        type=str,
+        metavar="STEP",
+        default=None,
+        help="skip the steps before STEP and re-run STEP and every step after it",
+    )
+    parser.add_argument(
+        "--only",
+        type=str,
+        nargs="+",
+        metavar="STEP",
+        default=None,
+        help="only run the listed steps, every other step is skipped",
+    )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        metavar="N",
+        default=1,
+        help="run independent steps at the same time with up to N workers (default: 1, run steps in order)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="re-run every step even if its inputs and settings are unchanged",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        choices=["cprofile", "pyinstrument"],
+        default=None,
+        help="profile every step that runs, profiles are written to <output_dir>/profiles",
+    )
 
 def run(args):
     configs_dir = args.configs_dir
     print(f"Running control-totals pipeline with configs in: {configs_dir}")
-    pipelinerunner.run(f'{configs_dir}/settings', dict_in={'configs_dir': configs_dir})
+    # time, memory and table reads/writes of every step, written to <output_dir>/run_report.json
+    report = RunReport(profiler=args.profile, parallel=args.parallel > 1)
+    # one pipeline for the whole run: tables saved by a step stay in memory for the
+    # next steps, are handed over without copies and are written to the store in the background
+    enable_copy_on_write()
+    pipeline = Pipeline(settings_path=configs_dir)
+    dict_in = {
+        'configs_dir': configs_dir,
+        'from_step': args.from_step,
+        'only_steps': args.only,
+        'force': args.force,
+        'run_report': report,
+        'pipeline': pipeline,
+    }
+    try:
+        if args.parallel > 1:
+            run_steps_parallel(configs_dir, dict_in, max_workers=args.parallel)
+        else:
+            pipelinerunner.run(f'{configs_dir}/settings', dict_in=dict_in)
+    finally:
+        try:
+            # waits for the background writer to finish writing saved tables
+            pipeline.close()
+        finally:
+            report.print_summary()
+            print(f"Run report saved to {report.save()}")
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
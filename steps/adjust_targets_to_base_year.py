@@ -1,5 +1,13 @@
 import pandas as pd
-from util import Pipeline
+from util import pipeline_step
+
+
+# control area estimates table used for each target type
+TARGET_TYPE_TABLES = {
+    'units': 'ofm_estimates',
+    'total_pop': 'ofm_estimates',
+    'emp': 'employment',
+}
 
 
 def get_emp_no_mil_res_con_col(pipeline, year):
@@ -23,94 +31,123 @@ def combine_targets(pipeline, target_type):
     return df[['target_id', f'{target_type}_chg', 'start']]
 
 
-def sum_estimates_to_target_area(pipeline, year, target_type, table):
-    # target_type: 'total_pop' or 'units' or 'emp'
-
-    p = pipeline
-    
+def get_estimate_col(pipeline, target_type, year):
+    # column in the control area estimates table for a target type and year
     if target_type == 'emp':
-        # get column name for employment excluding military, resource and construction
-        emp_col = get_emp_no_mil_res_con_col(p, year)
-        col_name = emp_col
-    else:
-        col_name = f'ofm_{target_type}'
-
-    # get control to target lookup
-    control_target_lookup = p.get_table('control_target_lookup')
-    
-    # sum estimates by control area
-    df = (
-        p.get_table(f'{table}_{year}_by_control_area')
-        # add year suffix to ofm column
-        .rename(columns={f'{col_name}':f'{target_type}_{year}'})
-        # join to target ids
-        .merge(control_target_lookup[['control_id', 'target_id']], on='control_id', how='left')
-        # groupby sum to target id
-        .groupby('target_id').sum().reset_index()
-        # return only target id and needed ofm column
-        [['target_id', f'{target_type}_{year}']]
-    )
-    return df
+        # column name for employment excluding military, resource and construction
+        return get_emp_no_mil_res_con_col(pipeline, year)
+    return f'ofm_{target_type}'
 
-def get_estimates_all_years(pipeline, start_years, target_type, table):
-    p = pipeline
-    base_year = p.settings['base_year']
 
-    # create empty dataframe to hold all years of needed ofm columns
-    est_all_years = pd.DataFrame()
-    
-    # loop through baseyear and start years and sum ofm to target area
+def build_estimates_cube(pipeline, years_by_type):
+    """
+    Sums the control area estimates to target areas for every target type and year
+    in one pass. Returns a long format series indexed by target_id, year and target_type.
 
-    for start_year in list(set([base_year] + start_years)):
-        ofm_df = sum_estimates_to_target_area(p, start_year, target_type, table)
+    years_by_type: dictionary of target type to the years needed for that type
+    """
+    p = pipeline
 
-        # merge to all years dataframe
-        est_all_years = est_all_years.merge(ofm_df, on='target_id', how='outer') if not est_all_years.empty else ofm_df
-    return est_all_years
+    # group the needed columns by source table, so each table is only read once
+    columns_by_table = {}
+    for target_type, years in years_by_type.items():
+        table = TARGET_TYPE_TABLES[target_type]
+        for year in years:
+            col = get_estimate_col(p, target_type, year)
+            columns_by_table.setdefault(f'{table}_{year}_by_control_area', {})[col] = (target_type, year)
+
+    # control to target lookup compiled to index arrays, shared by every table
+    lookup = p.get_incidence('control_target_lookup', 'control_id', 'target_id')
+
+    # sum each table to target ids and stack into target_id, year, target_type, value rows
+    est = []
+    for table_name, cols in columns_by_table.items():
+        df = p.get_table(table_name, columns=['control_id'] + list(cols))
+        by_target = lookup.aggregate(df['control_id'], df[list(cols)])
+        for col, (target_type, year) in cols.items():
+            est.append(pd.DataFrame({
+                'target_id': by_target['target_id'].to_numpy(),
+                'year': year,
+                'target_type': target_type,
+                'value': by_target[col].to_numpy(),
+            }))
+    return (
+        pd.concat(est, ignore_index=True)
+        .set_index(['target_id', 'year', 'target_type'])['value']
+        .sort_index()
+    )
 
-def adjust_targets(pipeline, target_type, table):
-    # target_type: 'pop' or 'units' or 'emp'
 
+def adjust_all_targets(pipeline):
+    # adjusts the units, total_pop and emp targets to the base year in one pass
     p = pipeline
     base_year = p.settings['base_year']
 
-    # combine county targets
-    df = combine_targets(p, target_type)
+    # combine county targets into one long table of all target types. The chg column takes
+    # the widest dtype of every type (float if any type has float targets), so each type's
+    # dtype is kept to save its adjusted targets with
+    targets = []
+    chg_dtypes = {}
+    for target_type in TARGET_TYPE_TABLES:
+        df = combine_targets(p, target_type).rename(columns={f'{target_type}_chg': 'chg'})
+        df['target_type'] = target_type
+        chg_dtypes[target_type] = df['chg'].dtype
+        targets.append(df)
+    targets = pd.concat(targets, ignore_index=True)
+
+    # get estimates for the base year and every start year of each target type
+    years_by_type = {
+        target_type: sorted(set([base_year] + df['start'].astype(int).tolist()))
+        for target_type, df in targets.groupby('target_type')
+    }
+    cube = build_estimates_cube(p, years_by_type)
+
+    # gather the base and start year estimates for every target with indexed lookups
+    start_idx = pd.MultiIndex.from_arrays([targets['target_id'], targets['start'].astype(int), targets['target_type']])
+    base_idx = pd.MultiIndex.from_arrays([targets['target_id'], [base_year] * len(targets), targets['target_type']])
+    est_chg = cube.reindex(base_idx).to_numpy() - cube.reindex(start_idx).to_numpy()
 
-    # get unique start years in the targets
-    start_years = df['start'].unique().tolist()
+    # fill NA, round and clip to 0 (no negative change)
+    targets['est_chg'] = pd.Series(est_chg, index=targets.index).fillna(0).round(0).clip(lower=0).astype(int)
+    # adjust target change by subtracting est change, minimum of 0
+    targets['chg_adj'] = (targets['chg'] - targets['est_chg']).clip(lower=0)
 
-    # get estimates for all start years and base year amd merge to targets
-    est_all_years = get_estimates_all_years(p, start_years, target_type, table)
-    df = df.merge(est_all_years, on='target_id', how='left')
+    for target_type, df in targets.groupby('target_type', sort=False):
+        save_adjusted_targets(p, target_type, df, cube, years_by_type[target_type], chg_dtypes[target_type])
 
-    # loop through each row to calculate change from target start year to base year
-    for index, row in df.iterrows():
-        start = int(row['start'])
-        start_col = f'{target_type}_{start}'
-        base_col = f'{target_type}_{base_year}'
-        est_chg_col = f'est_{target_type}_chg'
-        df.at[index, est_chg_col] = row[base_col] - row[start_col]
 
-    # fill NA, round and clip to 0 (no negative change)
-    df[est_chg_col] = df[est_chg_col].fillna(0).round(0).clip(lower=0).astype(int)
-    # adjust target change by subtracting est change, minimum of 0
-    chg_adj_col = f'{target_type}_chg_adj'
+def save_adjusted_targets(pipeline, target_type, df, cube, years, chg_dtype):
+    # chg_dtype is the dtype of the target type's change column in its targets tables
+    p = pipeline
     chg_col = f'{target_type}_chg'
-    df[chg_adj_col] = (df[chg_col] - df[est_chg_col]).clip(lower=0)
+    chg_adj_col = f'{target_type}_chg_adj'
+    est_chg_col = f'est_{target_type}_chg'
+    df = df.drop(columns='target_type').rename(columns={
+        'chg': chg_col, 'chg_adj': chg_adj_col, 'est_chg': est_chg_col
+    }).astype({chg_col: chg_dtype, chg_adj_col: chg_dtype})
+
+    # write the estimates used for each year alongside the targets for checking
+    est_by_year = (
+        cube.xs(target_type, level='target_type')
+        .unstack('year')
+        .reindex(columns=years)
+        .rename(columns=lambda year: f'{target_type}_{year}')
+    )
+    debug = df.merge(est_by_year, left_on='target_id', right_index=True, how='left')
+    debug.to_csv(f'{p.get_data_dir()}/debug_adjusted_{target_type}_change_targets.csv', index=False)
 
-    df.to_csv(f'data/debug_adjusted_{target_type}_change_targets.csv',index=False)
     # save adjusted targets table
     table_name = f'adjusted_{target_type}_change_targets'
-    out_df = df[['target_id','start',chg_col,chg_adj_col]]
+    out_df = df[['target_id','start',chg_col,chg_adj_col]].reset_index(drop=True)
     p.save_table(table_name,out_df)
 
 
-
-def run_step(context):
-    p = Pipeline(settings_path=context['configs_dir'])
+@pipeline_step(
+    reads=['*_targets', 'control_target_lookup', 'ofm_estimates_*_by_control_area',
+           'employment_*_by_control_area'],
+    writes=['adjusted_*_change_targets'],
+)
+def run_step(p):
+    # pypyr step
     print("Adjusting targets to base year using OFM and Employment estimates...")
-    adjust_targets(p,'units','ofm_estimates')
-    adjust_targets(p,'total_pop','ofm_estimates')
-    adjust_targets(p,'emp','employment')
-    return context
\ No newline at end of file
+    adjust_all_targets(p)
\ No newline at end of file
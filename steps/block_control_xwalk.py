@@ -1,33 +1,198 @@
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from util import Pipeline
+from util import pipeline_step, GEOMETRY_COL
+from util.partitions import split_by_county
+
+
+def join_blocks_to_control_areas(blk_pts, control_areas, max_distance):
+    """
+    Returns the control_id for each block point, and the distance to the
+    control area for blocks that don't fall inside one.
+
+    Most points fall inside a control area, so they are matched with an
+    indexed within predicate first. Only the remaining points use a nearest
+    search, limited to max_distance. Points further than that from every
+    control area fall back to an unbounded nearest search.
+    """
+    control_areas = control_areas[['control_id', 'geometry']]
+
+    # phase 1: points inside control areas (uses the STRtree spatial index)
+    within = gpd.sjoin(blk_pts, control_areas, how='inner', predicate='within')
+    # points on shared edges can be inside more than one control area, keep the first
+    within = within[~within.index.duplicated(keep='first')]
+    result = pd.DataFrame({'control_id': within['control_id'], 'distance': 0.0})
+
+    # phase 2: nearest control area within max_distance for the remaining points
+    unmatched = blk_pts.loc[~blk_pts.index.isin(within.index)]
+    if len(unmatched) > 0:
+        nearest = unmatched.sjoin_nearest(control_areas, how='inner', max_distance=max_distance,
+                                          distance_col='distance')
+        nearest = nearest[~nearest.index.duplicated(keep='first')]
+
+        # points further than max_distance from every control area
+        far = unmatched.loc[~unmatched.index.isin(nearest.index)]
+        if len(far) > 0:
+            far = far.sjoin_nearest(control_areas, how='inner', distance_col='distance')
+            far = far[~far.index.duplicated(keep='first')]
+            nearest = pd.concat([nearest, far])
+        result = pd.concat([result, nearest[['control_id', 'distance']]])
+
+    return result.loc[blk_pts.index]
+
+
+def hash_geometries(encoded):
+    # vectorized 64 bit hash of each encoded (WKB) geometry
+    return pd.util.hash_array(np.asarray(encoded, dtype=object))
+
+
+def get_encoded_geometry_col(pipeline, table_name):
+    # layers saved before geometries were stored as WKB use geometry_wkt
+    cols = pipeline.get_table_columns(table_name)
+    return GEOMETRY_COL if GEOMETRY_COL in cols else 'geometry_wkt'
+
+
+def load_previous_xwalk(pipeline, max_distance):
+    """
+    Returns the previous crosswalk, block hashes and control area hashes,
+    or None if there is no previous crosswalk to update.
+    """
+    p = pipeline
+    tables = ['block_control_xwalk', 'block_geometry_hashes', 'control_area_geometry_hashes', 
+              'block_control_xwalk_fallback', 'block_control_xwalk_state']
+    if not p.settings.get('xwalk_incremental', True) or not all(p.table_exists(t) for t in tables):
+        return None
+    # a different search distance can change any nearest match
+    if p.get_table('block_control_xwalk_state')['max_distance'].iloc[0] != max_distance:
+        return None
+    return {table: p.get_table(table) for table in tables}
+
+
+def find_affected_blocks(blk, blk_id, control_hashes, prev):
+    """
+    Returns a mask of the blocks that need to be joined again: blocks that are new
+    or changed, blocks whose point is in the bounding box (old or new) of a control
+    area that was added, removed or changed, and blocks that used the nearest
+    control area fallback last time.
+    """
+    prev_blk = prev['block_geometry_hashes'].set_index(blk_id)
+    prev_hash = prev_blk['hash'].reindex(blk[blk_id]).to_numpy()
+    changed_blocks = pd.isna(prev_hash) | (prev_hash != blk['hash'].to_numpy())
+    affected = changed_blocks.copy()
+
+    # control areas that were added, removed or changed
+    ca = control_hashes.merge(prev['control_area_geometry_hashes'], on='control_id',
+                              how='outer', suffixes=('', '_prev'), indicator=True)
+    changed = ca[(ca['_merge'] != 'both') | (ca['hash'] != ca['hash_prev'])]
+    boxes = pd.concat([
+        changed[['minx', 'miny', 'maxx', 'maxy']],
+        changed[['minx_prev', 'miny_prev', 'maxx_prev', 'maxy_prev']]
+        .set_axis(['minx', 'miny', 'maxx', 'maxy'], axis=1),
+    ]).dropna()
+
+    # points of unchanged blocks from the previous run, no geometry decoding needed
+    x = prev_blk['x'].reindex(blk[blk_id]).to_numpy()
+    y = prev_blk['y'].reindex(blk[blk_id]).to_numpy()
+    for minx, miny, maxx, maxy in boxes.itertuples(index=False):
+        affected |= (x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy)
+
+    affected |= blk[blk_id].isin(prev['block_control_xwalk_fallback'][blk_id]).to_numpy()
+    print(f"{len(changed)} control areas and {int(changed_blocks.sum())} "
+          f"blocks changed since the last crosswalk, re-joining {int(affected.sum())} of {len(blk)} blocks")
+    return affected
+
+
+def join_blocks(pipeline, blk_pts, control_areas, max_distance):
+    # spatial join block points to control areas one county at a time, in a process pool if partition_workers > 1.
+    # every county is joined against all control areas, so blocks match the same control area as in one join
+    p = pipeline
+    if len(blk_pts) == 0:
+        return join_blocks_to_control_areas(blk_pts, control_areas, max_distance)
+    partitions = {county_id: (part, control_areas, max_distance)
+                  for county_id, part in split_by_county(blk_pts, p.get_id_col('blocks')).items()}
+    return pd.concat(p.map_partitions(join_blocks_to_control_areas, partitions).values())
 
 
 def create_block_control_xwalk(pipeline):
     p = pipeline
-    
-    # load blocks geodataframe from h5
-    blk = p.get_geodataframe('blocks')
     blk_id = p.get_id_col('blocks')
+    max_distance = p.settings.get('xwalk_max_distance', 1000)
 
-    # load control areas geodataframe from h5
-    control_areas = p.get_geodataframe('control_areas')
-    
-    # convert blocks to centroids
-    blk_pts = blk.copy()
+    # load blocks with their encoded geometry, geometries are only decoded for blocks that get joined
+    # (reset index since streamed tables can repeat index values across chunks)
+    geom_col = get_encoded_geometry_col(p, 'blocks')
+    blk = p.get_table('blocks', columns=[blk_id, geom_col]).reset_index(drop=True)
+    blk['hash'] = hash_geometries(blk[geom_col])
+
+    # load control areas geodataframe with geometry hashes and bounding boxes
+    ca_geom_col = get_encoded_geometry_col(p, 'control_areas')
+    control_areas = p.get_table('control_areas', columns=['control_id', ca_geom_col])
+    control_hashes = pd.DataFrame({'control_id': control_areas['control_id'].to_numpy(),
+                                   'hash': hash_geometries(control_areas[ca_geom_col])})
+    control_areas = p.decode_geometry(control_areas)
+    control_hashes[['minx', 'miny', 'maxx', 'maxy']] = control_areas.bounds.to_numpy()
+
+    # only re-join blocks affected by changes since the previous crosswalk
+    prev = load_previous_xwalk(p, max_distance)
+    if prev is None:
+        affected = np.ones(len(blk), dtype=bool)
+    else:
+        affected = find_affected_blocks(blk, blk_id, control_hashes, prev)
+
+    # convert affected blocks to representative points
+    blk_pts = p.decode_geometry(blk.loc[affected, [blk_id, geom_col]])
     blk_pts['geometry'] = blk_pts.representative_point()
 
-    # spatial join block centroids to get control_id for each block
-    # uses sjoin_nearest to handle edge cases where centroids fall just outside control areas
+    # spatial join block points to get control_id for each block
+    # blocks outside every control area use the nearest control area within xwalk_max_distance
     # this shouldn't be a big issue since the edge cases mostly fell on waterways
-    blk_pts = blk_pts.sjoin_nearest(control_areas, how = 'left').drop(columns=['index_right'])
+    joined = join_blocks(p, blk_pts, control_areas, max_distance)
+    blk_pts['control_id'] = joined['control_id'].astype('int64')
+    blk_pts['distance'] = joined['distance']
+    blk_pts['x'] = blk_pts.geometry.x
+    blk_pts['y'] = blk_pts.geometry.y
+
+    # combine re-joined blocks with the unchanged blocks from the previous crosswalk
+    xwalk = blk[[blk_id, 'hash']].copy()
+    for col in ['control_id', 'distance', 'x', 'y']:
+        xwalk.loc[affected, col] = blk_pts[col].to_numpy()
+    if prev is not None and not affected.all():
+        prev_xwalk = (
+            prev['block_control_xwalk'].set_index(blk_id)['control_id']
+            .to_frame().join(prev['block_geometry_hashes'].set_index(blk_id)[['x', 'y']])
+        )
+        unchanged = prev_xwalk.reindex(blk.loc[~affected, blk_id])
+        for col in ['control_id', 'x', 'y']:
+            xwalk.loc[~affected, col] = unchanged[col].to_numpy()
+        xwalk.loc[~affected, 'distance'] = 0.0
+    xwalk['control_id'] = xwalk['control_id'].astype('int64')
+    report_fallback(p, xwalk, blk_id, max_distance)
+
+    # save block to control area crosswalk and the hashes used to update it next time
+    p.save_table('block_control_xwalk', xwalk[[blk_id, 'control_id']])
+    p.save_table('block_geometry_hashes', xwalk[[blk_id, 'hash', 'x', 'y']])
+    p.save_table('control_area_geometry_hashes', control_hashes)
+    p.save_table('block_control_xwalk_state', pd.DataFrame({'max_distance': [max_distance]}))
+
+
+def report_fallback(pipeline, blk_pts, blk_id, max_distance):
+    # print and save the blocks that weren't inside a control area
+    fallback = pd.DataFrame(blk_pts.loc[blk_pts['distance'] > 0, [blk_id, 'control_id', 'distance']])
+    print(f"{len(blk_pts) - len(fallback)} of {len(blk_pts)} blocks fall inside a control area, "
+          f"{len(fallback)} used the nearest control area")
+    if len(fallback) > 0:
+        print(f"Nearest control area distance: mean {fallback['distance'].mean():.1f}, "
+              f"max {fallback['distance'].max():.1f}, "
+              f"{(fallback['distance'] > max_distance).sum()} blocks beyond xwalk_max_distance ({max_distance})")
+    pipeline.save_table('block_control_xwalk_fallback', fallback.reset_index(drop=True))
 
-    # save block to control area crosswalk
-    p.save_table('block_control_xwalk', blk_pts[[blk_id, 'control_id']])
 
-def run_step(context):
+@pipeline_step(
+    reads=['blocks', 'control_areas'],
+    writes=['block_control_xwalk', 'block_control_xwalk_fallback', 'block_geometry_hashes',
+            'control_area_geometry_hashes', 'block_control_xwalk_state'],
+)
+def run_step(p):
     # pypyr step
     print("Creating block to control_area crosswalk...")
-    p = Pipeline(settings_path=context['configs_dir'])
     create_block_control_xwalk(p)
-    return context
@@ -0,0 +1,56 @@
+import os
+from util.elmer_helpers import get_engine, write_to_elmer
+from util import pipeline_step
+
+# file formats tables can be exported to, and the writer for each
+EXPORT_FORMATS = {
+    'csv': lambda df, path: df.to_csv(path, index=False),
+    'parquet': lambda df, path: df.to_parquet(path, index=False),
+}
+
+
+def write_output_files(pipeline, table_name, df, formats):
+    # writes a table to output_dir in each format, through a temporary file so a
+    # file that is open elsewhere is never left half written
+    p = pipeline
+    for fmt in formats:
+        path = f"{p.get_output_dir()}/{table_name}.{fmt}"
+        print(f"Writing {path}...")
+        tmp_path = f"{path}.tmp"
+        EXPORT_FORMATS[fmt](df, tmp_path)
+        os.replace(tmp_path, path)
+
+
+def export_outputs(pipeline):
+    """
+    Writes the tables in output_table_list to output_dir in export_formats, and
+    loads the tables that have a sql_table into Elmer (or the database in
+    elmer_connections, e.g. a local sqlite database for testing).
+    """
+    p = pipeline
+    tables = p.get_output_table_list()
+    formats = p.settings.get('export_formats', ['csv'])
+    invalid = [fmt for fmt in formats if fmt not in EXPORT_FORMATS]
+    if invalid:
+        raise ValueError(f"export_formats must be in: {', '.join(EXPORT_FORMATS)} (got {', '.join(invalid)})")
+
+    engine = None
+    if any('sql_table' in table for table in tables):
+        conn_str = p.settings.get('elmer_connections', {}).get('Elmer')
+        engine = get_engine('Elmer', conn_str)
+    chunksize = p.settings.get('export_chunksize', 10000)
+
+    for table in tables:
+        df = p.get_table(table['name'])
+        write_output_files(p, table['name'], df, formats)
+        if 'sql_table' in table:
+            print(f"Loading {table['name']} into {table['sql_table']} ({len(df)} rows)...")
+            write_to_elmer(df, table['sql_table'], engine=engine, chunksize=chunksize)
+
+
+# every table can be exported, so the step runs after the steps that write its tables
+@pipeline_step(reads=['*'])
+def run_step(p):
+    # pypyr step
+    print("Exporting output tables to files and Elmer...")
+    export_outputs(p)
@@ -1,12 +1,13 @@
+import numpy as np
 import pandas as pd
-from util import Pipeline, calc_gq
+from util import pipeline_step, calc_gq, balance_to_controls
 
 
 def load_targets_tables(pipeline):
     p = pipeline
 
-    unit_change_targets = p.get_table('adjusted_units_change_targets')
-    pop_change_targets = p.get_table('adjusted_total_pop_change_targets')
+    unit_change_targets = p.get_table('units_change_targets')
+    pop_change_targets = p.get_table('total_pop_change_targets')
     return pd.concat([unit_change_targets, pop_change_targets], ignore_index=True)
 
 
@@ -31,6 +32,72 @@ def extrapolate_target(pipeline,df,col):
     return df
 
 
+def interpolate_ref(pipeline, variable, years, base=None):
+    # regional REF projection of a variable for each year, linear between the REF years.
+    # base is an optional observed (year, value) the line starts from, REF years up to it are left out
+    ref = pipeline.get_table('ref_projection')
+    row = ref.loc[ref.variable == variable].drop(columns='variable').iloc[0]
+    ref_years = row.index.astype(int).to_numpy()
+    values = row.to_numpy(dtype=float)
+    if base is not None:
+        after = ref_years > base[0]
+        ref_years = np.append(ref_years[after], base[0])
+        values = np.append(values[after], base[1])
+    order = np.argsort(ref_years)
+    return np.interp(years, ref_years[order], values[order])
+
+
+def build_annual_series(pipeline, df):
+    """
+    Returns hh, total_pop, gq, hhpop and hhsz for every target area and every
+    year from base_year to end_year, computed as target x year arrays in one pass.
+
+    hh and total_pop follow the same straight line as extrapolate_target, from the
+    decennial value through the targets end year value. gq starts at decennial gq in
+    the base year and follows the regional REF gq from there, interpolated between REF
+    years. It is balanced to the target areas by their share of decennial gq like calc_gq,
+    so every year adds up exactly to the regional gq and REF years match the gq of the
+    targets tables.
+
+    The result has one row per year and target area, sorted by year and target_id,
+    so a single year is one contiguous block of rows.
+    """
+    p = pipeline
+    base_year = p.settings['base_year']
+    targets_end_year = p.settings['targets_end_year']
+    controls_end_year = p.settings['end_year']
+    years = np.arange(base_year, controls_end_year + 1)
+    offsets = (years - base_year)[np.newaxis, :]
+    df = df.sort_values('target_id')
+
+    series = {}
+    for col in ['hh', 'total_pop']:
+        base = df[f'dec_{col}'].to_numpy(dtype=float)[:, np.newaxis]
+        target = df[f'{col}_{targets_end_year}'].to_numpy(dtype=float)[:, np.newaxis]
+        annual_change = (target - base) / (targets_end_year - base_year)
+        series[col] = np.nan_to_num(np.rint(base + annual_change * offsets)).astype('int64')
+
+    # one column of decennial gq per year, each balanced to that year's regional gq.
+    # the base year total is the decennial total, so base year gq is decennial gq
+    dec_gq = df['dec_gq'].fillna(0).to_numpy(dtype=float)
+    reg_gq = np.rint(interpolate_ref(p, 'GQ Pop', years, base=(base_year, dec_gq.sum())))
+    seeds = pd.DataFrame(np.repeat(dec_gq[:, np.newaxis], len(years), axis=1), columns=years)
+    series['gq'] = balance_to_controls(seeds, list(years), [(None, reg_gq)]).to_numpy()
+    series['hhpop'] = series['total_pop'] - series['gq']
+    series['hhsz'] = np.divide(series['hhpop'], series['hh'], out=np.zeros(series['hh'].shape),
+                               where=series['hh'] > 0)
+
+    # target x year arrays to long rows, year major
+    n_targets = len(df)
+    out = pd.DataFrame({
+        'year': np.repeat(years, n_targets),
+        'target_id': np.tile(df['target_id'].to_numpy(), len(years)),
+    })
+    for measure, values in series.items():
+        out[measure] = values.T.ravel()
+    return out
+
+
 def extrapolate_to_controls_year(pipeline):
     p = pipeline
     # get controls horizon year from settings.yaml
@@ -51,11 +118,17 @@ def extrapolate_to_controls_year(pipeline):
     # save table
     p.save_table('extrapolated_targets', df)
 
-def run_step(context):
+    # save every year from base year to end year, years or target areas can be read with
+    # get_table filters, e.g. filters=[('year', '==', 2035)]
+    p.save_table('annual_control_totals', build_annual_series(p, df), data_columns=['year', 'target_id'])
+
+@pipeline_step(
+    reads=['units_change_targets', 'total_pop_change_targets', 'ref_projection'],
+    writes=['extrapolated_targets', 'annual_control_totals'],
+)
+def run_step(p):
     # pypyr step
-    p = Pipeline(settings_path=context['configs_dir'])
     controls_end_year = p.settings['end_year']
     targets_end_year = p.settings['targets_end_year']
     print(f'Extrapolating from targets end year ({targets_end_year}) to control total end year ({controls_end_year})...')
-    extrapolate_to_controls_year(p)
-    return context
\ No newline at end of file
+    extrapolate_to_controls_year(p)
\ No newline at end of file
@@ -1,27 +1,73 @@
 import os
-from util import Pipeline, CensusApi
+import pandas as pd
+from util import pipeline_step, CensusApi
+from util.census_helpers import HOST
+from util.census_cache import CensusCache
+
+
+def get_census_api_args(pipeline):
+    # CensusApi and CensusCache arguments from settings.yaml, as plain values that can be sent to worker processes
+    p = pipeline
+    api_args = {
+        'api_key': os.getenv(p.settings['CensusKey']),
+        'max_workers': p.settings.get('census_workers', 1),
+        'max_retries': p.settings.get('census_max_retries', 3),
+        'requests_per_second': p.settings.get('census_requests_per_second'),
+        'host': p.settings.get('census_host', HOST),
+    }
+    # cache census responses on disk so re-runs only fetch new variables
+    cache_settings = p.settings.get('census_cache')
+    cache_args = None
+    if cache_settings:
+        cache_args = {
+            'cache_dir': cache_settings.get('dir', f"{p.get_data_dir()}/census_cache"),
+            'ttl_days': cache_settings.get('ttl_days'),
+            'max_mb': cache_settings.get('max_mb'),
+        }
+    return api_args, cache_args
+
+
+def make_census_api(api_args, cache_args):
+    cache = CensusCache(**cache_args) if cache_args else None
+    return CensusApi(cache=cache, **api_args)
+
+
+def get_county_blocks(api_args, cache_args, dec_cols_dict, census_year, county_id, state_id):
+    # process pool worker: decennial block data of one county
+    c = make_census_api(api_args, cache_args)
+    return c.get_dec_data(dec_cols_dict, census_year, 'block', 'pl', [county_id], state_id)
 
 
 def get_dec_block_data(pipeline):
     p = pipeline
-    api_key = os.getenv(p.settings['CensusKey'])
-    c = CensusApi(api_key)
+    api_args, cache_args = get_census_api_args(p)
     census_year = p.settings.get('census_year')
 
     county_ids = p.settings['county_ids']
     state_id = p.settings['state_id']
     dec_cols_dict = p.settings['census_variables']
 
-    dec = (
-    c.get_dec_data(dec_cols_dict, census_year, 'block', 'pl', county_ids,state_id)
-    .drop(columns='name')
-    )
+    workers = min(p.get_partition_workers(), len(county_ids))
+    if workers > 1:
+        # one process per county, sharing the request rate limit and concurrency between them.
+        # the cache is only trimmed to max_mb once every county is fetched
+        worker_api_args = dict(api_args, max_workers=max(api_args['max_workers'] // workers, 1))
+        if api_args['requests_per_second']:
+            worker_api_args['requests_per_second'] = api_args['requests_per_second'] / workers
+        worker_cache_args = dict(cache_args, max_mb=None) if cache_args else None
+        partitions = {county_id: (worker_api_args, worker_cache_args, dec_cols_dict, census_year, county_id, state_id)
+                      for county_id in county_ids}
+        dec = pd.concat(p.map_partitions(get_county_blocks, partitions).values(), ignore_index=True)
+        if cache_args:
+            CensusCache(**cache_args).evict()
+    else:
+        c = make_census_api(api_args, cache_args)
+        dec = c.get_dec_data(dec_cols_dict, census_year, 'block', 'pl', county_ids, state_id)
 
-    p.save_table('dec_block_data', dec)
+    p.save_table('dec_block_data', dec.drop(columns='name'))
 
-def run_step(context):
+@pipeline_step(writes=['dec_block_data'])
+def run_step(p):
     # pypyr step
-    p = Pipeline(settings_path=context['configs_dir'])
     print("Getting Decennial Census block data and saving to HDF5...")
     get_dec_block_data(p)
-    return context
\ No newline at end of file
@@ -1,35 +1,116 @@
-from util.elmer_helpers import read_from_elmer_geo, read_from_elmer
-from util import Pipeline
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from util.elmer_helpers import (
+    read_from_elmer_geo, read_from_elmer_geo_chunks, read_from_elmer, get_engine, GEOMETRY_EXPR
+)
+from util import pipeline_step
 
+# marks the end of a fetch job on the results queue
+JOB_DONE = object()
 
-def copy_elmer_geo_to_hdf5(pipeline):
-    # loop through ElmerGeo files specified in settings.yaml
-    for file in pipeline.get_elmer_geo_list():
-        gdf = read_from_elmer_geo(file['sql_table'],file['columns'])
-        
-        # convert id column to int64
-        gdf = pipeline.convert_id_to_int64(file, gdf)
 
-        # save to HDF5
-        pipeline.save_geodataframe(file['name'], gdf)
+def get_elmer_engines(pipeline):
+    # one pooled engine per database, connection strings can be overridden in settings.yaml
+    conn_strs = pipeline.settings.get('elmer_connections', {})
+    return {database: get_engine(database, conn_strs.get(database))
+            for database in ['ElmerGeo', 'Elmer']}
+
+def fetch_elmer_geo(file, engine, chunksize, results, stop):
+    # read one ElmerGeo feature class and put it on the results queue, stops early if stop is set
+    geometry_expr = file.get('geometry_expr', GEOMETRY_EXPR)
+
+    # stream large feature classes in chunks if a chunksize is set
+    if chunksize:
+        chunks = read_from_elmer_geo_chunks(file['sql_table'], file['columns'], chunksize,
+                                            engine=engine, geometry_expr=geometry_expr)
+        for i, gdf in enumerate(chunks):
+            if stop.is_set():
+                return
+            # first chunk replaces any existing table, the rest are appended
+            results.put((file, gdf, True, i > 0, True))
+        return
+
+    gdf = read_from_elmer_geo(file['sql_table'], file['columns'],
+                              engine=engine, geometry_expr=geometry_expr)
+    results.put((file, gdf, True, False, False))
+
+def fetch_elmer(table, engine, results, stop):
+    # read one Elmer table and put it on the results queue
+    df = read_from_elmer(table['sql_table'], ['*'], engine=engine)
+    results.put((table, df, False, False, False))
+
+def run_job(job, results, stop):
+    # run a fetch job and always signal the writer when it ends
+    func, args = job
+    try:
+        # jobs that start after an error are skipped
+        if not stop.is_set():
+            func(*args, results, stop)
+    except Exception as e:
+        results.put((JOB_DONE, e, None, None, None))
+    else:
+        results.put((JOB_DONE, None, None, None, None))
+
+def write_results(pipeline, results, n_jobs, stop):
+    # single writer: only this thread touches the pipeline store. After an error
+    # the fetch threads are stopped and the queue is drained until every job has
+    # ended, so no thread is left blocked on a full queue
+    errors = []
+    done = 0
+    while done < n_jobs:
+        table, df, is_geo, append, streamed = results.get()
+        if table is JOB_DONE:
+            done += 1
+            if df is not None:
+                errors.append(df)
+                stop.set()
+            continue
+        if errors:
+            # keep draining the queue so the fetch threads can finish
+            continue
 
-def copy_elmer_to_hdf5(pipeline):
-    # loop through Elmer tables specified in settings.yaml
-    for table in pipeline.get_elmer_list():
-        df = read_from_elmer(table['sql_table'],['*'])
-        
         # convert id column to int64
         df = pipeline.convert_id_to_int64(table, df)
-        
-        # save to HDF5
-        pipeline.save_table(table['name'], df)
+
+        # save to store
+        # streamed layers size their string columns (the encoded geometry) when the first
+        # chunk is saved, min_itemsize on the layer sets a size for longer geometries in later chunks
+        min_itemsize = table.get('min_itemsize', {}) if streamed else None
+        try:
+            if is_geo:
+                pipeline.save_geodataframe(table['name'], df, append=append, min_itemsize=min_itemsize)
+            else:
+                pipeline.save_table(table['name'], df, append=append)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+    if errors:
+        raise errors[0]
+
+def copy_elmer_data_to_store(pipeline):
+    # fetch the ElmerGeo and Elmer tables in settings.yaml concurrently,
+    # while the results are written to the store one at a time
+    engines = get_elmer_engines(pipeline)
+    default_chunksize = pipeline.settings.get('elmer_geo_chunksize')
+    jobs = (
+        [(fetch_elmer_geo, (file, engines['ElmerGeo'], file.get('chunksize', default_chunksize)))
+         for file in pipeline.get_elmer_geo_list()]
+        + [(fetch_elmer, (table, engines['Elmer'])) for table in pipeline.get_elmer_list()]
+    )
+    workers = pipeline.settings.get('elmer_workers', 4)
+
+    # bounded queue so fetch threads can't get far ahead of the writer
+    results = queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for job in jobs:
+            executor.submit(run_job, job, results, stop)
+        write_results(pipeline, results, len(jobs), stop)
 
 
-def run_step(context):
+@pipeline_step(writes=['control_areas', 'blocks', 'ofm_estimates_*'])
+def run_step(p):
     # pypyr step
-    p = Pipeline(settings_path=context['configs_dir'])
-    print("Getting ElmerGeo data and saving to HDF5...")
-    copy_elmer_geo_to_hdf5(p)
-    print("Getting Elmer data and saving to HDF5...")
-    copy_elmer_to_hdf5(p)
-    return context
+    print("Getting ElmerGeo and Elmer data and saving to the pipeline store...")
+    copy_elmer_data_to_store(p)
@@ -1,21 +1,37 @@
 import pandas as pd
-from util import Pipeline
+from concurrent.futures import ThreadPoolExecutor
+from util import pipeline_step
+
+# dtypes of id columns that can be in any input csv, tables can declare more with a dtypes key.
+# target_id is left to inference, control areas without a target (e.g. rural areas and
+# military bases) have a blank target_id in control_target_lookup
+CSV_DTYPES = {
+    'control_id': 'int64',
+    'RGID': 'int64',
+    'county_id': 'int64',
+}
+
+
+def read_csv(file_path, dtypes):
+    # read with the multithreaded pyarrow csv parser, or the default parser if pyarrow isn't installed
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return pd.read_csv(file_path, dtype=dtypes)
+    return pd.read_csv(file_path, dtype=dtypes, engine='pyarrow')
 
-def load_data_tables_to_hdf5(pipeline):
-    # load general data tables in the data_tables list in settings.yaml
-    p = pipeline
-    data_tables = p.settings.get('data_tables', [])
-    for table in data_tables:
-        table_name = table['name']
-        file_path = f"{p.get_data_dir()}/{table['file']}"
-        print(f"Loading {file_path} into HDF5 as {table_name}...")
-        df = pd.read_csv(file_path)
-        
-        # check that the correct columns are present
-        data_check_tables(df, table_name)
 
-        # save to HDF5
-        p.save_table(table_name, df)
+def get_csv_dtypes(file_path, table):
+    # declared dtypes for the columns in the file header
+    dtypes = {**CSV_DTYPES, **table.get('dtypes', {})}
+    header = pd.read_csv(file_path, nrows=0).columns
+    return {col: dtype for col, dtype in dtypes.items() if col in header}
+
+
+def prepare_data_table(df, table):
+    # check that the correct columns are present
+    data_check_tables(df, table['name'])
+    return df
 
 def data_check_tables(df, table_name):
     if table_name == 'control_areas':
@@ -23,25 +39,15 @@ def data_check_tables(df, table_name):
             raise ValueError("control_areas table must have control_id column.")
 
 
-def load_targets_to_hdf5(pipeline):
-    # load target tables for each county
-    p = pipeline
-    for table in p.settings['targets_tables']:
-        table_name = table['name']
-        file_path = f"{p.get_data_dir()}/{table['file']}"
-        print(f"Loading {file_path} into HDF5 as {table_name}...")
-        df = pd.read_csv(file_path)
-        
-        # rename columns based on settings
-        for col in ['total_pop_chg_col', 'units_chg_col', 'emp_chg_col']:
-            if col in table:
-                df.rename(columns={table[f'{col}']: col.replace('_col', '')}, inplace=True, errors='ignore')
-        
-        # check that the correct columns are present
-        data_check_targets(df, table_name)
-        
-        # save to HDF5
-        p.save_table(table_name, df)
+def prepare_targets_table(df, table):
+    # rename columns based on settings
+    for col in ['total_pop_chg_col', 'units_chg_col', 'emp_chg_col']:
+        if col in table:
+            df.rename(columns={table[f'{col}']: col.replace('_col', '')}, inplace=True, errors='ignore')
+
+    # check that the correct columns are present
+    data_check_targets(df, table['name'])
+    return df
 
 def data_check_targets(df, table_name):
     # each targets table should have either units_chg or total_pop_chg, but not both
@@ -55,10 +61,42 @@ def data_check_targets(df, table_name):
     if 'units_chg' not in df.columns and 'total_pop_chg' not in df.columns:
         raise ValueError(f"{table_name} must have either units_chg or total_pop_chg column.")
 
-def run_step(context):
+
+def load_csv_tables(pipeline):
+    """
+    Loads the data_tables and targets_tables csv files in settings.yaml into the store.
+    Files are read concurrently, and files that haven't changed since they were last
+    loaded (with the same settings) are skipped.
+    """
+    p = pipeline
+    jobs = (
+        [(table, prepare_data_table) for table in p.settings.get('data_tables', [])]
+        + [(table, prepare_targets_table) for table in p.settings['targets_tables']]
+    )
+
+    pending = []
+    for table, prepare in jobs:
+        file_path = f"{p.get_data_dir()}/{table['file']}"
+        p.register_input_file(file_path)
+        if p.is_file_load_current(table['name'], file_path, table):
+            print(f"Skipping {file_path}: unchanged since it was loaded as {table['name']}")
+            continue
+        pending.append((table, prepare, file_path))
+
+    # parse files in threads, tables are saved one at a time as they finish
+    workers = max(min(p.settings.get('load_workers', 4), len(pending)), 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(read_csv, file_path, get_csv_dtypes(file_path, table))
+                   for table, _, file_path in pending]
+        for (table, prepare, file_path), future in zip(pending, futures):
+            print(f"Loading {file_path} into the store as {table['name']}...")
+            df = prepare(future.result(), table)
+            p.save_table(table['name'], df)
+            p.record_file_load(table['name'], file_path, table)
+
+
+@pipeline_step(writes=['control_target_lookup', 'ref_projection', 'employment_*_by_control_area', '*_targets'])
+def run_step(p):
     # pypyr step
-    p = Pipeline(settings_path=context['configs_dir'])
-    print("Loading data tables from CSV files into HDF5...")
-    load_data_tables_to_hdf5(p)
-    load_targets_to_hdf5(p)
-    return context
\ No newline at end of file
+    print("Loading data tables from CSV files into the store...")
+    load_csv_tables(p)
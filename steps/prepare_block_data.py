@@ -1,26 +1,50 @@
 import pandas as pd
-from util import Pipeline
+from util import pipeline_step
 
 
+OFM_COLS = ['housing_units', 'occupied_housing_units', 
+            'group_quarters_population', 'household_population']
+
+
+def sum_block_table(pipeline, xwalk, table_name, id_col, value_cols):
+    """
+    Sums the value columns of a block level table to control areas. If
+    stream_block_tables is set in settings.yaml the table is read in chunks
+    sized to stream_memory_mb and summed into running totals, so memory use
+    doesn't grow with the number of blocks. The sum isn't split by county across
+    partition_workers: it is a single bincount, cheaper than sending each county's
+    rows to a worker process.
+
+    Parameters
+    ----------
+    xwalk: block to control area Incidence
+
+    table_name: name of the block table in the store
+
+    id_col: block id column of the table
+
+    value_cols: list of columns to sum
+    """
+    p = pipeline
+    columns = [id_col] + value_cols
+    if p.settings.get('stream_block_tables', False):
+        return xwalk.aggregate_chunks(p.iter_table(table_name, columns=columns), id_col, value_cols)
+    df = p.get_table(table_name, columns=columns)
+    return xwalk.aggregate(df[id_col], df[value_cols])
+
 def sum_decennial_by_control_area(pipeline):
     p = pipeline
-    dec = p.get_table('dec_block_data')
-    blk = p.get_table('block_control_xwalk')
     block_id = p.get_id_col('blocks')
 
-    # merge decennial data with block to control area crosswalk
-    df = dec.merge(blk, left_on='geoid', right_on=block_id)
+    # block to control area crosswalk compiled to index arrays
+    xwalk = p.get_incidence('block_control_xwalk', block_id, 'control_id')
 
     # get list of decennial census columns
     dec_cols = list(p.settings['census_variables'].keys())
 
     # sum decennial data by control area
-    dec_by_control = (
-        df.groupby('control_id')
-        .sum()[dec_cols]
-        .astype(int)
-        .reset_index()
-    )
+    dec_by_control = sum_block_table(p, xwalk, 'dec_block_data', 'geoid', dec_cols)
+    dec_by_control[dec_cols] = dec_by_control[dec_cols].astype(int)
 
     # calculate hhpop
     dec_by_control['dec_hhpop'] = (
@@ -43,22 +67,14 @@ def get_ofm_years(pipeline):
 def sum_ofm_by_control_area(pipeline):
     p = pipeline
     years = get_ofm_years(p)
+    block_id = p.get_id_col('blocks')
+    # the crosswalk is compiled once and reused for every year
+    xwalk = p.get_incidence('block_control_xwalk', block_id, 'control_id')
     for year in years:
-        ofm = p.get_table(f'ofm_estimates_{year}')
         ofm_block_id = p.get_id_col(f'ofm_estimates_{year}')
-        blk = p.get_table('block_control_xwalk')
-        block_id = p.get_id_col('blocks')
-
-        # merge ofm data with block to control area crosswalk
-        df = ofm.merge(blk, left_on=ofm_block_id, right_on=block_id)
-
-        # sum ofm data by control area
-        ofm_by_control = (
-            df.groupby('control_id')
-            .sum()[['housing_units', 'occupied_housing_units', 
-                    'group_quarters_population', 'household_population']]
-            .reset_index()
-        )
+
+        # sum ofm data by control area, only the block id and the columns that get aggregated are read
+        ofm_by_control = sum_block_table(p, xwalk, f'ofm_estimates_{year}', ofm_block_id, OFM_COLS)
 
         # rename columns
         ofm_col_map = {
@@ -77,11 +93,13 @@ def sum_ofm_by_control_area(pipeline):
         # save to HDF5
         p.save_table(f'ofm_estimates_{year}_by_control_area', ofm_by_control)
 
-def run_step(context):
+@pipeline_step(
+    reads=['dec_block_data', 'block_control_xwalk', 'ofm_estimates_*'],
+    writes=['decennial_by_control_area', 'ofm_estimates_*_by_control_area'],
+)
+def run_step(p):
     # pypyr step
-    p = Pipeline(settings_path=context['configs_dir'])
     print("Aggregating Decennial Census data to control area level...")
     sum_decennial_by_control_area(p)
     print("Aggregating OFM estimates data to control area level...")
-    sum_ofm_by_control_area(p)
-    return context
\ No newline at end of file
+    sum_ofm_by_control_area(p)
\ No newline at end of file
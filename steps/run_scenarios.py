@@ -0,0 +1,78 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from util import pipeline_step
+from util.scenarios import ScenarioPipeline, apply_overrides, combine_scenario_outputs, \
+    SCENARIO_SETTINGS, SHARED_SETTINGS
+from steps import units_chg_targets, total_pop_chg_targets, extrapolate_to_controls_year
+
+
+# tables the target calculations read, shared by every scenario
+SHARED_TABLES = ['control_target_lookup', 'decennial_by_control_area', 'ref_projection',
+                 'adjusted_units_change_targets', 'adjusted_total_pop_change_targets']
+
+
+def load_shared_inputs(pipeline):
+    # the tables every scenario reads, loaded once from the store
+    p = pipeline
+    return {name: p.get_table(name) for name in SHARED_TABLES}
+
+
+def get_scenarios(pipeline):
+    # base settings plus one settings dictionary per scenario, the base scenario is always included
+    p = pipeline
+    base = {key: p.settings[key] for key in SCENARIO_SETTINGS + SHARED_SETTINGS if key in p.settings}
+    scenarios = {'base': base}
+    for scenario in p.settings.get('scenarios') or []:
+        overrides = dict(scenario)
+        scenario_id = str(overrides.pop('scenario_id'))
+        if scenario_id in scenarios:
+            raise ValueError(f"scenario_id {scenario_id} is used more than once")
+        scenarios[scenario_id] = apply_overrides(base, overrides)
+    return scenarios
+
+
+def run_scenario(args):
+    # runs the target calculations for one scenario, process pool worker
+    scenario_id, settings, tables = args
+    p = ScenarioPipeline(scenario_id, settings, tables)
+    units_chg_targets.calculate_targets(p)
+    total_pop_chg_targets.calculate_targets(p)
+    extrapolate_to_controls_year.extrapolate_to_controls_year(p)
+    return scenario_id, p.outputs
+
+
+def run_scenarios(pipeline):
+    p = pipeline
+    scenarios = get_scenarios(p)
+    tables = load_shared_inputs(p)
+    jobs = [(scenario_id, settings, tables) for scenario_id, settings in scenarios.items()]
+
+    # scenarios are independent, run them in a process pool if scenario_workers > 1
+    workers = min(p.settings.get('scenario_workers', 1), len(jobs))
+    if workers > 1:
+        # spawned workers don't inherit the shared pipeline's background writer thread or open
+        # store, like Pipeline.map_partitions
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            outputs = dict(executor.map(run_scenario, jobs))
+    else:
+        outputs = dict(map(run_scenario, jobs))
+
+    # save one table per output with every scenario, keyed by scenario_id
+    for table_name, df in combine_scenario_outputs(outputs).items():
+        p.save_table(f'scenario_{table_name}', df, data_columns=['scenario_id'])
+        csv_path = f'{p.get_output_dir()}/scenario_{table_name}.csv'
+        print(f"Writing {csv_path}...")
+        df.to_csv(csv_path, index=False)
+
+
+@pipeline_step(
+    reads=['control_target_lookup', 'decennial_by_control_area', 'ref_projection',
+           'adjusted_units_change_targets', 'adjusted_total_pop_change_targets'],
+    writes=['scenario_*'],
+)
+def run_step(p):
+    # pypyr step
+    n = len(p.settings.get('scenarios') or [])
+    print(f"Calculating targets for the base settings and {n} scenarios...")
+    run_scenarios(p)
@@ -1,5 +1,5 @@
 import pandas as pd
-from util import Pipeline, load_input_tables, calc_gq
+from util import pipeline_step, load_input_tables, calc_gq
 
 
 def calc_dec_hhsz(dec):
@@ -48,12 +48,15 @@ def calculate_targets(pipeline):
     df[hh_horizon_col] = (df[hhpop_horizon_col] / df[hhsz_horizon_col]).round(0).astype(int)
     
     # Save table
-    p.save_table('adjusted_total_pop_change_targets', df)
+    p.save_table('total_pop_change_targets', df)
 
 
-def run_step(context):
+@pipeline_step(
+    reads=['control_target_lookup', 'decennial_by_control_area',
+           'adjusted_total_pop_change_targets', 'ref_projection'],
+    writes=['total_pop_change_targets'],
+)
+def run_step(p):
     # pypyr step
-    p = Pipeline(settings_path=context['configs_dir'])
     print('Calculating targets for counties that use population targets...')
-    calculate_targets(p)
-    return context
\ No newline at end of file
+    calculate_targets(p)
\ No newline at end of file
@@ -1,5 +1,5 @@
 import pandas as pd
-from util import Pipeline, load_input_tables, calc_gq
+from util import pipeline_step, load_input_tables, calc_gq, balance_to_controls
 
 
 def load_hhsz_vacancy_rates(pipeline):
@@ -45,10 +45,10 @@ def calc_by_rgid(pipeline, targets_df):
     # load total household population target for horizon year
     hhpop_horizon_forced_total = p.settings['king_hhpop_2044']
 
-    # factor household population to match target
-    hhpop_horizon_sum = df[hhpop_init_horizon_col].sum()
-    hhpop_factor = hhpop_horizon_forced_total / hhpop_horizon_sum
-    df[hhpop_factored_horizon_col] = (df[hhpop_init_horizon_col] * hhpop_factor).round(0).astype(int)
+    # factor household population to match target, rounded so the rgids add up exactly to it
+    df[hhpop_factored_horizon_col] = balance_to_controls(
+        df, [hhpop_init_horizon_col], [(None, hhpop_horizon_forced_total)]
+    )[hhpop_init_horizon_col]
     return df
 
 
@@ -105,9 +105,13 @@ def calc_by_target_area(pipeline, df, targets_rgid):
                     }), on='RGID', how='left')
     )
 
-    # calculate factored hhpop for target horizon year
+    # calculate factored hhpop for target horizon year, rounded so the target areas
+    # add up exactly to the factored hhpop of their rgid
     df['hhpop_factor'] = df[f'hhpop_rgid_factored_{targets_end_year}'] / df[hhpop_horizon_sum_by_rgid_col]
-    df[hhpop_factored_horizon_col] = (df[hhpop_init_horizon_col] * df['hhpop_factor']).round(0).astype(int)
+    rgid_totals = targets_rgid.set_index('RGID')[hhpop_factored_horizon_col]
+    df[hhpop_factored_horizon_col] = balance_to_controls(
+        df, [hhpop_init_horizon_col], [('RGID', rgid_totals)]
+    )[hhpop_init_horizon_col]
     return df
 
 
@@ -139,12 +143,15 @@ def calculate_targets(pipeline):
     df = calc_by_target_area(p, df, targets_rgid)
     df = calc_gq_tot_pop(p, df, dec)
     # save table
-    p.save_table('adjusted_units_change_targets',df)
+    p.save_table('units_change_targets',df)
 
 
-def run_step(context):
+@pipeline_step(
+    reads=['control_target_lookup', 'decennial_by_control_area', 'adjusted_units_change_targets',
+           'ref_projection'],
+    writes=['units_change_targets'],
+)
+def run_step(p):
     # pypyr step
-    p = Pipeline(settings_path=context['configs_dir'])
     print('Calculating targets for counties that use housing targets...')
     calculate_targets(p)
-    return context
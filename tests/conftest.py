@@ -0,0 +1,21 @@
+import pytest
+import yaml
+from util import Pipeline
+
+
+@pytest.fixture
+def make_pipeline(tmp_path):
+    # returns a function that opens a Pipeline with a settings.yaml of the given settings
+    # and a store under tmp_path. Pipelines are closed after the test
+    pipelines = []
+
+    def make(**settings):
+        settings = {'data_dir': str(tmp_path / 'data'), 'output_dir': str(tmp_path / 'output'), **settings}
+        (tmp_path / 'settings.yaml').write_text(yaml.safe_dump(settings))
+        p = Pipeline(settings_path=str(tmp_path))
+        pipelines.append(p)
+        return p
+
+    yield make
+    for p in pipelines:
+        p.close()
@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+from steps.adjust_targets_to_base_year import adjust_all_targets
+
+pytest.importorskip('tables')
+
+
+@pytest.fixture
+def pipeline(make_pipeline):
+    p = make_pipeline(
+        base_year=2020,
+        write_behind=False,
+        data_tables=[{'name': 'employment_2018_by_control_area', 'no_mil_res_con_col': 'emp'},
+                     {'name': 'employment_2020_by_control_area', 'no_mil_res_con_col': 'emp'}],
+        targets_tables=[
+            {'name': 'a_targets', 'units_chg_col': 'Units', 'units_chg_start': 2018,
+             'emp_chg_col': 'Jobs', 'emp_chg_start': 2018},
+            {'name': 'b_targets', 'total_pop_chg_col': 'Pop', 'total_pop_chg_start': 2018,
+             'emp_chg_col': 'Jobs', 'emp_chg_start': 2018},
+        ],
+    )
+    p.save_table('control_target_lookup', pd.DataFrame({'control_id': [1, 2, 3, 4], 'target_id': [10, 10, 20, 30]}))
+    for year, growth in [(2018, 0), (2020, 1)]:
+        p.save_table(f'ofm_estimates_{year}_by_control_area', pd.DataFrame({
+            'control_id': [1, 2, 3, 4],
+            'ofm_units': [100 + 5 * growth, 50, 80 + 20 * growth, 10],
+            'ofm_total_pop': [200, 120 + 30 * growth, 150, 40 + 7 * growth],
+        }))
+        p.save_table(f'employment_{year}_by_control_area', pd.DataFrame({
+            'control_id': [1, 2, 3, 4], 'emp': [30.0, 20.0, 40.0 + 2.5 * growth, 5.0]}))
+    # like Kitsap, one county has fractional employment targets
+    p.save_table('a_targets', pd.DataFrame({'target_id': [10, 20], 'units_chg': [50, 10], 'emp_chg': [12.5, 4.25]}))
+    p.save_table('b_targets', pd.DataFrame({'target_id': [30], 'total_pop_chg': [100], 'emp_chg': [3]}))
+    return p
+
+
+def test_adjusted_targets_keep_their_dtype(pipeline):
+    adjust_all_targets(pipeline)
+    units = pipeline.get_table('adjusted_units_change_targets')
+    assert units.dtypes[['units_chg', 'units_chg_adj']].tolist() == ['int64', 'int64']
+    assert units['units_chg_adj'].tolist() == [45, 0]
+
+    total_pop = pipeline.get_table('adjusted_total_pop_change_targets')
+    assert total_pop.dtypes[['total_pop_chg', 'total_pop_chg_adj']].tolist() == ['int64', 'int64']
+    assert total_pop['total_pop_chg_adj'].tolist() == [93]
+
+    emp = pipeline.get_table('adjusted_emp_change_targets').set_index('target_id')
+    assert emp['emp_chg'].dtype == 'float64'
+    # estimated changes are rounded, 2.5 jobs to 2
+    assert emp['emp_chg_adj'].to_dict() == {10: 12.5, 20: 2.25, 30: 3.0}
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+from util.aggregation import Incidence
+from util.partitions import split_by_county
+
+
+@pytest.fixture
+def lookup():
+    # control area to target lookup, like control_target_lookup: some control
+    # areas have no target and target 30 has no control area with data
+    return pd.DataFrame({
+        'control_id': [1, 2, 3, 4, 5, 6, 7],
+        'target_id': [10, 10, 20, np.nan, 20, 30, np.nan],
+        'RGID': [1, 1, 2, 2, 2, 3, 3],
+        'county_id': [33, 33, 35, 35, 35, 53, 53],
+    })
+
+
+@pytest.fixture
+def table():
+    # control area table with int and float columns, missing values and a
+    # control area (8) and a target (30, control area 6) that aren't in each other
+    return pd.DataFrame({
+        'control_id': [5, 1, 2, 3, 4, 7, 8, 1, 5],
+        'units': [10, 20, 30, 40, 50, 60, 70, 5, 1],
+        'pop': [1.5, np.nan, 2.25, 4.0, 8.0, 16.0, 32.0, 0.5, np.nan],
+    })
+
+
+def merge_groupby(lookup, dst_cols, table, value_cols):
+    # what Incidence replaced: merge the lookup onto the table and sum by destination
+    return (
+        table[['control_id'] + value_cols]
+        .merge(lookup[['control_id'] + dst_cols], on='control_id')
+        .groupby(dst_cols)[value_cols].sum()
+        .reset_index()
+    )
+
+
+@pytest.mark.parametrize('dst_cols', [['target_id'], ['target_id', 'RGID', 'county_id'], ['county_id']])
+def test_aggregate_matches_merge_groupby(lookup, table, dst_cols):
+    incidence = Incidence(lookup['control_id'], lookup[dst_cols])
+    result = incidence.aggregate(table['control_id'], table[['units', 'pop']])
+    expected = merge_groupby(lookup, dst_cols, table, ['units', 'pop'])
+    pd.testing.assert_frame_equal(result, expected)
+    assert result['units'].dtype == 'int64'
+    assert result['pop'].dtype == 'float64'
+
+
+def test_missing_keys_are_left_out(lookup, table):
+    incidence = Incidence(lookup['control_id'], lookup['target_id'])
+    result = incidence.aggregate(table['control_id'], table[['units']])
+    # control areas without a target (4, 7) and not in the lookup (8) are dropped,
+    # and target 30 has no rows so it isn't in the result
+    assert result['target_id'].tolist() == [10.0, 20.0]
+    assert result['units'].tolist() == [55, 51]
+
+
+@pytest.mark.parametrize('chunksize', [1, 2, 4, 100])
+def test_aggregate_chunks_matches_aggregate(lookup, table, chunksize):
+    incidence = Incidence(lookup['control_id'], lookup[['target_id', 'RGID']])
+    chunks = (table.iloc[start:start + chunksize] for start in range(0, len(table), chunksize))
+    result = incidence.aggregate_chunks(chunks, 'control_id', ['units', 'pop'])
+    pd.testing.assert_frame_equal(result, incidence.aggregate(table['control_id'], table[['units', 'pop']]))
+    pd.testing.assert_frame_equal(result, merge_groupby(lookup, ['target_id', 'RGID'], table, ['units', 'pop']))
+
+
+def test_partial_sums_by_county_match_aggregate():
+    # block table split by county, like the block level tables
+    rng = np.random.default_rng(0)
+    blocks = np.array([530330001001000, 530330001001001, 530350002002000, 530530003003000,
+                       530530003003001, 530610004004000], dtype='int64')
+    xwalk = pd.DataFrame({'geoid': blocks, 'control_id': [1, 2, 3, 3, 4, np.nan]})
+    table = pd.DataFrame({
+        'geoid': rng.choice(blocks, 50),
+        'dec_total_pop': rng.integers(0, 100, 50),
+        'ofm_hhpop': rng.random(50) * 100,
+    })
+    value_cols = ['dec_total_pop', 'ofm_hhpop']
+    incidence = Incidence(xwalk['geoid'], xwalk['control_id'])
+    partials = [incidence.partial_sum(part['geoid'], part[value_cols])
+                for part in split_by_county(table, 'geoid').values()]
+    result = incidence.combine(partials, value_cols)
+    expected = (
+        table.merge(xwalk, on='geoid')
+        .groupby('control_id')[value_cols].sum()
+        .reset_index()
+    )
+    pd.testing.assert_frame_equal(result, expected)
+    assert result['dec_total_pop'].dtype == 'int64'
+
+
+def test_source_ids_must_be_unique():
+    with pytest.raises(ValueError, match='unique'):
+        Incidence(pd.Series([1, 1, 2]), pd.Series([10, 20, 30]))
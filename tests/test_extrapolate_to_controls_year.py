@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+from steps.extrapolate_to_controls_year import build_annual_series
+from util import calc_gq
+
+pytest.importorskip('tables')
+
+
+@pytest.fixture
+def pipeline(make_pipeline):
+    p = make_pipeline(base_year=2020, targets_end_year=2044, end_year=2050, write_behind=False)
+    p.save_table('ref_projection', pd.DataFrame({
+        'variable': ['GQ Pop', 'Total Pop'],
+        '2017': [59049, 4000000],
+        '2044': [82181, 5000000],
+        '2050': [87051, 5200000],
+    }))
+    return p
+
+
+@pytest.fixture
+def targets():
+    # target areas with decennial values and targets end year values, in a shuffled order
+    rng = np.random.default_rng(0)
+    n = 40
+    dec_hh = rng.integers(500, 5000, n)
+    dec_gq = rng.integers(0, 900, n)
+    dec_total_pop = dec_hh * 2 + dec_gq + rng.integers(0, 500, n)
+    return pd.DataFrame({
+        'target_id': rng.permutation(n) + 1,
+        'dec_hh': dec_hh,
+        'dec_total_pop': dec_total_pop,
+        'dec_gq': dec_gq,
+        'dec_hhpop': dec_total_pop - dec_gq,
+        'hh_2044': dec_hh + rng.integers(0, 2000, n),
+        'total_pop_2044': dec_total_pop + rng.integers(0, 4000, n),
+    })
+
+
+def test_annual_gq_matches_ref_every_year(pipeline, targets):
+    out = build_annual_series(pipeline, targets)
+    assert (out['gq'] >= 0).all()
+    sums = out.groupby('year')['gq'].sum()
+    assert sums[2044] == 82181
+    assert sums[2050] == 87051
+    # years between REF years add up to the interpolated regional gq
+    assert sums[2047] == round(82181 + (87051 - 82181) / 2)
+
+
+@pytest.mark.parametrize('year', [2044, 2050])
+def test_annual_gq_matches_calc_gq(pipeline, targets, year):
+    # the target areas' gq in REF years is the same as in the targets tables
+    expected = calc_gq(pipeline, targets.copy(), targets[['target_id', 'dec_gq']], year)
+    out = build_annual_series(pipeline, targets)
+    gq = out[out['year'] == year].set_index('target_id')['gq']
+    assert gq.to_dict() == expected.set_index('target_id')[f'gq_{year}'].to_dict()
+
+
+def test_annual_series_starts_at_decennial_values(pipeline, targets):
+    out = build_annual_series(pipeline, targets)
+    base = out[out['year'] == 2020].set_index('target_id')
+    targets = targets.set_index('target_id').loc[base.index]
+    for col in ['hh', 'total_pop', 'gq', 'hhpop']:
+        assert base[col].tolist() == targets[f'dec_{col}'].tolist()
+    # from the decennial total towards the next REF year
+    sums = out.groupby('year')['gq'].sum()
+    assert sums[2032] == round(targets['dec_gq'].sum() + (82181 - targets['dec_gq'].sum()) / 2)
@@ -0,0 +1,90 @@
+import threading
+import pandas as pd
+import pytest
+
+pytest.importorskip('tables')
+
+
+def make_table(n, start=0):
+    return pd.DataFrame({'id': range(start, start + n), 'value': [float(i) for i in range(start, start + n)]})
+
+
+@pytest.fixture
+def blocked_writer(monkeypatch):
+    # holds the background writer in the store until release is set
+    release = threading.Event()
+
+    def block(pipeline):
+        write_table = pipeline._write_table
+
+        def blocked_write_table(*args):
+            release.wait(10)
+            write_table(*args)
+        monkeypatch.setattr(pipeline, '_write_table', blocked_write_table)
+    yield block, release
+    release.set()
+
+
+def test_write_behind_waits_over_memory_limit(make_pipeline, blocked_writer):
+    block, release = blocked_writer
+    p = make_pipeline(write_behind=True, write_behind_mb=0.01)
+    block(p)
+    # the first table is queued even though it is larger than the limit
+    p.save_table('first', make_table(1000))
+    saved = threading.Event()
+    saver = threading.Thread(target=lambda: (p.save_table('second', make_table(10)), saved.set()))
+    saver.start()
+    assert not saved.wait(0.2)
+
+    release.set()
+    assert saved.wait(10)
+    saver.join()
+    p.flush()
+    assert p._queued_bytes == 0
+    pd.testing.assert_frame_equal(p.store.get('second'), make_table(10))
+
+
+def test_write_behind_queues_under_memory_limit(make_pipeline, blocked_writer):
+    block, release = blocked_writer
+    p = make_pipeline(write_behind=True, write_behind_mb=1)
+    block(p)
+    for i in range(5):
+        p.save_table('chunks', make_table(10, start=i * 10), append=True)
+    assert p._pending == {'chunks': 5}
+    release.set()
+    p.flush()
+    pd.testing.assert_frame_equal(p.store.get('chunks').reset_index(drop=True), make_table(50))
+
+
+def test_cache_hits_dont_wait_for_store_reads(make_pipeline):
+    p = make_pipeline(write_behind=False)
+    p.save_table('cached', make_table(10))
+    p.save_table('stored', make_table(10))
+    p._invalidate_table('stored')
+
+    store_held = threading.Event()
+    release = threading.Event()
+
+    def hold_store():
+        # stands in for the writer serializing a large table
+        with p._store_lock:
+            store_held.set()
+            release.wait(10)
+    holder = threading.Thread(target=hold_store)
+    holder.start()
+    store_held.wait(10)
+    reader = threading.Thread(target=p.get_table, args=('stored',))
+    reader.start()
+    try:
+        # the cache miss waits for the store, the cache hit doesn't
+        reader.join(0.2)
+        assert reader.is_alive()
+        hit = threading.Thread(target=p.get_table, args=('cached',))
+        hit.start()
+        hit.join(5)
+        assert not hit.is_alive()
+    finally:
+        release.set()
+        holder.join()
+        reader.join()
+    assert 'stored' in p._table_cache
@@ -0,0 +1,99 @@
+import pytest
+from util.manifest import Manifest, StepRecord, TrackedSettings
+from util.step_runner import get_run_reason
+
+
+class StorePipeline:
+    # the parts of a Pipeline get_run_reason uses, with the store as a set of table names
+    def __init__(self, tmp_path, settings):
+        self.settings = TrackedSettings(settings)
+        self.manifest = Manifest(str(tmp_path / 'manifest.json'))
+        self.store = set()
+
+    def table_exists(self, table_name):
+        return table_name in self.store
+
+    def run(self, step_name, reads=(), writes=(), settings_keys=()):
+        # records a run of a step that read and wrote tables, like run_recorded
+        record = StepRecord()
+        for table_name in writes:
+            record.writes.add(table_name)
+            self.manifest.update_table(table_name, f"{table_name}-hash")
+            self.store.add(table_name)
+        for table_name in reads:
+            record.add_read(table_name)
+        record.settings_keys.update(settings_keys)
+        self.manifest.update_step(step_name, record, self.settings)
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    p = StorePipeline(tmp_path, {
+        'steps': ['steps.load_data', 'steps.adjust_targets', 'steps.export_outputs'],
+        'base_year': 2020,
+        'table_cache_mb': 512,
+    })
+    p.manifest.update_table('targets', 'targets-hash')
+    p.store.add('targets')
+    p.run('steps.adjust_targets', reads=['targets'], writes=['adjusted_targets'], settings_keys=['base_year'])
+    return p
+
+
+def test_new_step_runs(pipeline):
+    assert get_run_reason(pipeline, 'steps.load_data', {}) == 'no previous run'
+
+
+def test_unchanged_step_is_skipped(pipeline):
+    assert get_run_reason(pipeline, 'steps.adjust_targets', {}, ['adjusted_targets']) is None
+
+
+def test_changed_input_table_reruns(pipeline):
+    pipeline.manifest.update_table('targets', 'new-targets-hash')
+    assert get_run_reason(pipeline, 'steps.adjust_targets', {}) == 'inputs or settings changed'
+
+
+def test_changed_setting_reruns(pipeline):
+    pipeline.settings['base_year'] = 2023
+    assert get_run_reason(pipeline, 'steps.adjust_targets', {}) == 'inputs or settings changed'
+
+
+def test_untracked_setting_is_skipped(pipeline):
+    # settings that only change how the pipeline runs don't make steps re-run
+    pipeline.settings['table_cache_mb'] = 64
+    pipeline.manifest.steps['steps.adjust_targets']['settings_keys'].append('table_cache_mb')
+    assert get_run_reason(pipeline, 'steps.adjust_targets', {}) is None
+
+
+def test_missing_output_reruns(pipeline):
+    pipeline.store.discard('adjusted_targets')
+    assert get_run_reason(pipeline, 'steps.adjust_targets', {}) == 'outputs missing from the store'
+
+
+def test_missing_declared_output_reruns(pipeline):
+    # a declared output the manifest record doesn't list, e.g. after the step's writes changed
+    reason = get_run_reason(pipeline, 'steps.adjust_targets', {}, ['adjusted_targets', 'units_change_targets'])
+    assert reason == 'outputs missing from the store'
+    # patterns are only checked through the manifest
+    assert get_run_reason(pipeline, 'steps.adjust_targets', {}, ['adjusted_*']) is None
+
+
+def test_force_reruns(pipeline):
+    assert get_run_reason(pipeline, 'steps.adjust_targets', {'force': True}) == 'forced with --force'
+
+
+def test_only_steps(pipeline):
+    context = {'only_steps': ['load_data']}
+    assert get_run_reason(pipeline, 'steps.load_data', context) == 'selected with --only'
+    assert get_run_reason(pipeline, 'steps.adjust_targets', context) is None
+
+
+def test_from_step(pipeline):
+    context = {'from_step': 'adjust_targets'}
+    assert get_run_reason(pipeline, 'steps.load_data', context) is None
+    assert get_run_reason(pipeline, 'steps.adjust_targets', context) == 'at or after --from-step'
+    assert get_run_reason(pipeline, 'steps.export_outputs', context) == 'at or after --from-step'
+
+
+def test_from_step_not_in_steps(pipeline):
+    with pytest.raises(ValueError, match='--from-step'):
+        get_run_reason(pipeline, 'steps.load_data', {'from_step': 'no_such_step'})
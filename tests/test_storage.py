@@ -0,0 +1,163 @@
+import pandas as pd
+import pytest
+from util.storage import HDF5Backend, ParquetBackend
+
+pytest.importorskip('tables')
+
+
+def make_blocks(start, n, name='block'):
+    return pd.DataFrame({
+        'block_id': range(start, start + n),
+        'county_id': [53033 if i % 2 else 53061 for i in range(start, start + n)],
+        'name': [f"{name} {i}" for i in range(start, start + n)],
+        'pop': [float(i) for i in range(start, start + n)],
+    })
+
+
+@pytest.fixture(params=['hdf5', 'parquet'])
+def backend(request, tmp_path):
+    if request.param == 'parquet':
+        pytest.importorskip('pyarrow')
+        store = ParquetBackend(str(tmp_path))
+    else:
+        store = HDF5Backend(str(tmp_path))
+    yield store
+    store.close()
+
+
+def read(store, table_name, **kwargs):
+    # rows in block_id order, with a fresh index, so backends can be compared
+    return store.get(table_name, **kwargs).sort_values('block_id').reset_index(drop=True)
+
+
+def test_put_get_round_trip(backend):
+    df = make_blocks(0, 10)
+    backend.put('blocks', df, data_columns=['county_id'])
+    assert backend.exists('blocks')
+    assert backend.get_columns('blocks') == list(df.columns)
+    pd.testing.assert_frame_equal(read(backend, 'blocks'), df)
+
+
+def test_put_replaces_table(backend):
+    backend.put('blocks', make_blocks(0, 10))
+    backend.put('blocks', make_blocks(100, 3))
+    assert read(backend, 'blocks')['block_id'].tolist() == [100, 101, 102]
+
+
+def test_append_round_trip(backend):
+    chunks = [make_blocks(0, 5), make_blocks(5, 5), make_blocks(10, 3)]
+    for chunk in chunks:
+        backend.append('blocks', chunk)
+    expected = pd.concat(chunks, ignore_index=True)
+    pd.testing.assert_frame_equal(read(backend, 'blocks'), expected)
+    assert sum(len(chunk) for chunk in backend.iter_chunks('blocks', chunksize=4)) == 13
+
+
+def test_append_to_put_table(backend):
+    backend.put('blocks', make_blocks(0, 5), data_columns=['county_id'], min_itemsize={})
+    backend.append('blocks', make_blocks(5, 5))
+    pd.testing.assert_frame_equal(read(backend, 'blocks'), make_blocks(0, 10))
+
+
+@pytest.mark.parametrize('filters', [
+    [('county_id', '==', 53033)],
+    [('county_id', 'in', [53033]), ('pop', '>=', 4.0)],
+    [('name', '!=', 'block 3'), ('block_id', '<', 8)],
+])
+def test_filters(backend, filters):
+    df = make_blocks(0, 10)
+    backend.put('blocks', df, data_columns=['county_id'])
+    ops = {'==': '__eq__', '!=': '__ne__', '<': '__lt__', '>=': '__ge__'}
+    mask = pd.Series(True, index=df.index)
+    for col, op, value in filters:
+        mask &= df[col].isin(value) if op == 'in' else getattr(df[col], ops[op])(value)
+    expected = df[mask].reset_index(drop=True)
+    pd.testing.assert_frame_equal(read(backend, 'blocks', filters=filters), expected)
+
+    # filter columns that aren't requested are read for filtering and dropped
+    result = read(backend, 'blocks', columns=['block_id', 'pop'], filters=filters)
+    pd.testing.assert_frame_equal(result, expected[['block_id', 'pop']])
+
+
+def test_filters_on_appended_table(backend):
+    for start in range(0, 12, 4):
+        backend.append('blocks', make_blocks(start, 4))
+    result = read(backend, 'blocks', columns=['block_id'], filters=[('county_id', '==', 53061), ('block_id', '>', 5)])
+    assert result['block_id'].tolist() == [6, 8, 10]
+
+
+def test_hdf5_append_longer_strings_raises(tmp_path):
+    store = HDF5Backend(str(tmp_path))
+    store.append('blocks', make_blocks(0, 5))
+    # string columns are sized at twice their longest value when the table is created
+    store.append('blocks', make_blocks(5, 5, name='block b'))
+    with pytest.raises(ValueError, match='min_itemsize'):
+        store.append('blocks', make_blocks(10, 5, name='a block with a much longer name'))
+    assert len(store.get('blocks')) == 10
+    store.close()
+
+
+def test_hdf5_min_itemsize(tmp_path):
+    store = HDF5Backend(str(tmp_path))
+    store.append('blocks', make_blocks(0, 5), min_itemsize={'name': 64})
+    store.append('blocks', make_blocks(5, 5, name='a block with a much longer name'))
+    assert store.get('blocks')['name'].iloc[-1] == 'a block with a much longer name 9'
+    store.close()
+
+
+@pytest.fixture(params=['hdf5', 'parquet'])
+def pipeline(request, make_pipeline):
+    if request.param == 'parquet':
+        pytest.importorskip('pyarrow')
+    return make_pipeline(storage_backend=request.param, write_behind=False,
+                         table_schemas={'blocks': {'county_id': 'category', 'block_id': 'int'}})
+
+
+@pytest.mark.parametrize('cached', [True, False])
+def test_pipeline_filters_on_restored_dtypes(pipeline, cached):
+    # range filters on a column stored as a categorical compare the restored values
+    # whether the table is read from the cache or from the store
+    df = make_blocks(0, 10)
+    pipeline.save_table('blocks', df)
+    if not cached:
+        pipeline.clear_cache()
+    filters = [('county_id', '>', 53040), ('block_id', '>=', 4)]
+    result = pipeline.get_table('blocks', columns=['block_id', 'pop'], filters=filters)
+    assert result['block_id'].tolist() == [4, 6, 8]
+    assert result['block_id'].dtype == 'int64'
+
+    result = pipeline.get_table('blocks', filters=filters)
+    assert result['county_id'].dtype == 'int64'
+    assert result['county_id'].tolist() == [53061, 53061, 53061]
+
+
+@pytest.mark.parametrize('new_session', [False, True])
+def test_pipeline_append_uses_stored_dtypes(pipeline, new_session):
+    # the first save stores county_id as a categorical and block_id as int8,
+    # appended rows are converted to the same dtypes
+    pipeline.save_table('blocks', make_blocks(0, 10), min_itemsize={})
+    if new_session:
+        pipeline.clear_cache()
+        pipeline._stored_dtypes.clear()
+    pipeline.save_table('blocks', make_blocks(10, 10), append=True)
+    pipeline.save_table('blocks', make_blocks(20, 4).iloc[::-1], append=True)
+    result = pipeline.get_table('blocks').sort_values('block_id').reset_index(drop=True)
+    pd.testing.assert_frame_equal(result, make_blocks(0, 24))
+
+
+def test_pipeline_append_values_that_dont_fit(pipeline):
+    pipeline.save_table('blocks', make_blocks(0, 10))
+    with pytest.raises(ValueError, match='block_id values appended to blocks'):
+        pipeline.save_table('blocks', make_blocks(1000, 2), append=True)
+    new_county = make_blocks(10, 2).assign(county_id=53035)
+    with pytest.raises(ValueError, match='county_id values appended to blocks'):
+        pipeline.save_table('blocks', new_county, append=True)
+
+
+def test_hdf5_append_other_errors_are_not_rewrapped(tmp_path):
+    store = HDF5Backend(str(tmp_path))
+    store.append('blocks', make_blocks(0, 5))
+    with pytest.raises(ValueError) as error:
+        store.append('blocks', make_blocks(5, 5).astype({'block_id': 'int8'}))
+    assert 'min_itemsize' not in str(error.value)
+    store.close()
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+from util.targets_calculations import balance_to_controls, integerize
+
+
+@pytest.fixture
+def areas():
+    # 8 control areas in 2 counties and 3 regional geographies, with fractional seeds
+    return pd.DataFrame({
+        'county_id': [33, 33, 33, 35, 35, 35, 53, 53],
+        'RGID': [1, 2, 2, 1, 3, 3, 2, 3],
+        'pop': [120.4, 80.2, 33.3, 10.0, 55.5, 0.7, 240.9, 18.1],
+        'units': [50.5, 31.1, 12.2, 4.4, 20.0, 0.3, 99.9, 7.7],
+    }, index=[10, 11, 12, 13, 14, 15, 16, 17])
+
+
+def test_balance_to_controls_matches_every_control_exactly(areas):
+    county_totals = pd.DataFrame({'pop': [300, 90, 260], 'units': [100, 30, 110]}, index=[33, 35, 53])
+    controls = [(None, [650, 240]), ('county_id', county_totals)]
+    result = balance_to_controls(areas, ['pop', 'units'], controls)
+
+    assert list(result.columns) == ['pop', 'units']
+    assert result.index.equals(areas.index)
+    assert (result.dtypes == 'int64').all()
+    assert (result >= 0).all().all()
+    sums = result.groupby(areas['county_id']).sum()
+    pd.testing.assert_frame_equal(sums, county_totals, check_names=False)
+    assert result['pop'].sum() == 650
+    assert result['units'].sum() == 240
+
+
+def test_balance_to_controls_single_total_series(areas):
+    rgid_totals = pd.Series({1: 101, 2: 407, 3: 77})
+    result = balance_to_controls(areas, ['pop'], [(None, 585), ('RGID', rgid_totals)])
+    assert result['pop'].groupby(areas['RGID']).sum().to_dict() == rgid_totals.to_dict()
+
+
+def test_balance_to_controls_is_deterministic(areas):
+    # equal seeds make every remainder a tie, ties go to the first area
+    df = areas.assign(pop=1.0)
+    totals = pd.Series({33: 2, 35: 1, 53: 1})
+    first = balance_to_controls(df, ['pop'], [('county_id', totals)])
+    second = balance_to_controls(df, ['pop'], [('county_id', totals)])
+    pd.testing.assert_frame_equal(first, second)
+    assert first['pop'].tolist() == [1, 1, 0, 1, 0, 0, 1, 0]
+
+
+def test_balance_to_controls_leaves_zero_seed_groups_at_zero(areas):
+    df = areas.assign(pop=np.where(areas['county_id'] == 35, 0.0, areas['pop']))
+    totals = pd.Series({33: 300, 35: 90, 53: 260})
+    result = balance_to_controls(df, ['pop'], [('county_id', totals)])
+    assert (result.loc[areas['county_id'] == 35, 'pop'] == 0).all()
+    assert result.loc[areas['county_id'] == 33, 'pop'].sum() == 300
+
+
+def test_balance_to_controls_missing_control_key(areas):
+    totals = pd.Series({33: 300, 35: 90})
+    with pytest.raises(ValueError, match='county_id'):
+        balance_to_controls(areas, ['pop'], [('county_id', totals)])
+
+
+def test_integerize_largest_remainder():
+    values = np.array([[1.5], [1.25], [1.25], [4.0]])
+    codes = np.array([0, 0, 0, 1])
+    totals = np.array([[5.0], [4.0]])
+    # group 0 is scaled to 1.875, 1.5625, 1.5625 and rounded down to 3 units, the 2 missing
+    # units go to the largest remainder and then the first of the tied areas
+    assert integerize(values, codes, totals)[:, 0].tolist() == [2, 2, 1, 4]
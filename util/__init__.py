@@ -1,3 +1,27 @@
-from .pipeline import Pipeline
-from .census_helpers import CensusApi
-from .targets_calculations import load_input_tables, calc_gq
\ No newline at end of file
+import importlib
+
+# names exported by util and the module each one is in. Modules are imported on first
+# use, so a step only loads the dependencies (geopandas, requests, ...) of what it uses
+_EXPORTS = {
+    'Pipeline': 'pipeline',
+    'GEOMETRY_COL': 'pipeline',
+    'CensusApi': 'census_helpers',
+    'load_input_tables': 'targets_calculations',
+    'calc_gq': 'targets_calculations',
+    'balance_to_controls': 'targets_calculations',
+    'pipeline_step': 'step_runner',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{_EXPORTS[name]}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+
+
+class Incidence:
+    """
+    Many-to-one mapping from source ids (e.g. blocks) to destination keys
+    (e.g. control areas), compiled into integer index arrays. Tables keyed on
+    the source id are aggregated to the destination keys with one np.bincount
+    per column, without merging the mapping onto the table.
+    """
+    def __init__(self, src_ids, dst_keys):
+        """
+        Parameters
+        ----------
+        src_ids: unique source ids
+
+        dst_keys: series or dataframe of destination keys, one row per source id.
+                Rows with a missing key are left out of every aggregation.
+        """
+        self.src_index = pd.Index(src_ids)
+        if not self.src_index.is_unique:
+            raise ValueError("Incidence source ids must be unique (each source maps to one destination)")
+        dst_keys = pd.DataFrame(dst_keys).reset_index(drop=True)
+        grouped = dst_keys.groupby(list(dst_keys.columns), sort=True, dropna=True)
+        self.dst_codes = grouped.ngroup().fillna(-1).astype('int64').to_numpy()
+        self.dst_keys = grouped.size().index.to_frame(index=False)
+
+    def get_codes(self, ids):
+        # Returns the destination code of each id, -1 for ids that aren't mapped
+        pos = self.src_index.get_indexer(ids)
+        return np.where(pos >= 0, self.dst_codes[pos], -1)
+
+    def _sum(self, ids, values):
+        # Returns the sums of each value column by destination code, and a mask of
+        # the destinations with at least one matched row
+        codes = self.get_codes(np.asarray(ids))
+        matched = codes >= 0
+        codes = codes[matched]
+        n = len(self.dst_keys)
+        present = np.bincount(codes, minlength=n) > 0
+
+        sums = {}
+        for col in values.columns:
+            col_values = values[col].to_numpy()[matched]
+            if np.issubdtype(col_values.dtype, np.floating):
+                # missing values count as 0, like groupby().sum()
+                col_values = np.nan_to_num(col_values)
+            summed = np.bincount(codes, weights=col_values, minlength=n)
+            if np.issubdtype(col_values.dtype, np.integer):
+                summed = np.rint(summed).astype('int64')
+            sums[col] = summed
+        return sums, present
+
+    def _to_frame(self, sums, present):
+        out = self.dst_keys.copy()
+        for col, summed in sums.items():
+            out[col] = summed
+        return out[present].reset_index(drop=True)
+
+    def aggregate(self, ids, values):
+        """
+        Sums the value columns of a table to the destination keys.
+
+        Parameters
+        ----------
+        ids: source id of each row
+
+        values: dataframe of numeric columns to sum
+
+        Returns a dataframe with the destination key columns followed by the summed
+        columns, for destinations with at least one matched row (like groupby().sum()).
+        Integer columns stay integers.
+        """
+        return self._to_frame(*self._sum(ids, values))
+
+    def partial_sum(self, ids, values):
+        """
+        Sums the value columns of part of a table (a chunk or a county) by destination.
+        Partial sums of every part of a table are added up with combine().
+
+        Parameters
+        ----------
+        ids: source id of each row
+
+        values: dataframe of numeric columns to sum
+        """
+        return self._sum(ids, values)
+
+    def combine(self, partials, value_cols):
+        """
+        Adds up partial sums into the same dataframe aggregate() returns for
+        the whole table.
+
+        Parameters
+        ----------
+        partials: iterable of partial_sum() results
+
+        value_cols: list of the summed columns
+        """
+        n = len(self.dst_keys)
+        totals = {col: np.zeros(n, dtype='int64') for col in value_cols}
+        present = np.zeros(n, dtype=bool)
+        for sums, part_present in partials:
+            for col in value_cols:
+                totals[col] = totals[col] + sums[col]
+            present |= part_present
+        return self._to_frame(totals, present)
+
+    def aggregate_chunks(self, chunks, id_col, value_cols):
+        """
+        Sums the value columns of a table read in chunks to the destination keys,
+        keeping running totals per destination. Gives the same result as aggregate()
+        on the whole table, with only one chunk in memory at a time.
+
+        Parameters
+        ----------
+        chunks: iterable of dataframes, e.g. from Pipeline.iter_table
+
+        id_col: source id column of the chunks
+
+        value_cols: list of numeric columns to sum
+        """
+        partials = (self._sum(chunk[id_col], chunk[value_cols]) for chunk in chunks)
+        return self.combine(partials, value_cols)
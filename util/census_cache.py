@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+import time
+import pandas as pd
+
+
+class CensusCache:
+    """
+    Content-addressed disk cache for census api responses. Each entry holds a single
+    variable for one request (year, dataset, for and in predicates), so editing
+    census_variables only fetches the variables that aren't cached yet.
+    Entries are stored as gzip compressed pickles.
+    """
+    def __init__(self, cache_dir, ttl_days=None, max_mb=None):
+        """
+        Parameters
+        ----------
+        cache_dir: directory the cache entries are written to
+
+        ttl_days: optional age in days after which an entry is fetched again
+
+        max_mb: optional size limit for the cache, least recently used entries
+                are removed first
+        """
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_days * 86400 if ttl_days else None
+        self.max_bytes = max_mb * 1024 ** 2 if max_mb else None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(year, dataset_url, for_predicates, in_predicates, variable):
+        # hash of everything that determines the response for a variable
+        if isinstance(in_predicates, tuple):
+            in_predicates = list(in_predicates)
+        request = json.dumps([str(year), dataset_url, for_predicates, in_predicates, variable])
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def path(self, key):
+        return f"{self.cache_dir}/{key}.pkl.gz"
+
+    def get(self, key):
+        # Returns the cached dataframe, or None if it isn't cached or has expired
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        if self.ttl_seconds and time.time() - os.path.getmtime(path) > self.ttl_seconds:
+            os.remove(path)
+            return None
+        # access time marks the entry as recently used for eviction
+        os.utime(path, (time.time(), os.path.getmtime(path)))
+        return pd.read_pickle(path, compression='gzip')
+
+    def put(self, key, df):
+        # write to a temporary file first so readers never see a partial entry
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        df.to_pickle(tmp_path, compression='gzip')
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        # removes least recently used entries until the cache is under max_mb
+        if not self.max_bytes:
+            return
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pkl.gz'):
+                stat = os.stat(f"{self.cache_dir}/{name}")
+                entries.append((stat.st_atime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(f"{self.cache_dir}/{name}")
+            total -= size
@@ -1,34 +1,186 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-import requests
+
+HOST = "https://api.census.gov/data"
+
+# geography columns the census api adds to every response
+GEO_COLS = ['state', 'county', 'tract', 'block group', 'block', 'place', 'congressional district']
+
+# rate limiting and server errors are retried, other errors are raised right away
+RETRY_STATUS = [429, 500, 502, 503, 504]
 
 
 class CensusApi:
-    def __init__(self, api_key, timeout=15):
+    def __init__(self, api_key, timeout=15, max_workers=1, max_retries=3, backoff=1.0,
+                 requests_per_second=None, host=HOST, cache=None):
+        """
+        Parameters
+        ----------
+        api_key: census api key
+
+        timeout: seconds to wait for each response
+
+        max_workers: number of requests sent at the same time
+
+        max_retries: number of times a failed request is retried
+
+        backoff: seconds to wait before the first retry, doubled on each retry
+
+        requests_per_second: optional limit on the request rate across all workers
+
+        host: census api host, can be pointed at a local stub server for testing
+
+        cache: optional CensusCache, cached variables are not requested again
+        """
         self.api_key = api_key
         self.timeout = timeout
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.requests_per_second = requests_per_second
+        self.host = host
+        self.cache = cache
+
+        # keep-alive session shared by all workers
+        # requests is imported here so importing this module doesn't load it
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._rate_lock = threading.Lock()
+        self._next_request_time = 0.0
+
+    def wait_for_rate_limit(self):
+        # spaces requests out evenly across all workers
+        if not self.requests_per_second:
+            return
+        with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_request_time - now
+            self._next_request_time = max(now, self._next_request_time) + 1 / self.requests_per_second
+        if wait > 0:
+            time.sleep(wait)
+
+    def request(self, url, params):
+        """
+        Sends one request and returns the response as a dataframe, retrying
+        rate limited and failed requests with exponential backoff.
+        """
+        import requests
+        for attempt in range(self.max_retries + 1):
+            self.wait_for_rate_limit()
+            try:
+                r = self.session.get(url, params=params, timeout=self.timeout)
+                if r.status_code in RETRY_STATUS:
+                    raise requests.ConnectionError(f"Census API returned {r.status_code}")
+                r.raise_for_status()
+                data = r.json()
+                return pd.DataFrame(data[1:], columns=data[0])
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    @staticmethod
+    def partition_in_predicates(in_predicates):
+        """
+        Splits in_predicates that cover several counties into one set of
+        in_predicates per county, so large geographies can be requested per county.
+        """
+        if not isinstance(in_predicates, tuple):
+            return [in_predicates]
+        partitions = [()]
+        for predicate in in_predicates:
+            geog, _, values = predicate.partition(':')
+            if geog == 'county':
+                partitions = [p + (f'county:{value}',) for p in partitions for value in values.split(',')]
+            else:
+                partitions = [p + (predicate,) for p in partitions]
+        return partitions
 
     def get_table(self, variables, year, for_predicates, in_predicates, dataset_url):
         """
         Takes in a list of variables and returns a dataframe
         """
-        HOST = "https://api.census.gov/data"
-        base_url = "/".join([HOST, str(year), dataset_url])
-        chunks = [variables[x:x+45] for x in range(0, len(variables), 45)]
-        df = pd.DataFrame()
-        for chunk in chunks:
-            predicates = {}
-            predicates["get"] = ",".join(chunk)
-            predicates["for"] = for_predicates
-            if in_predicates is not None:
-                predicates["in"] = in_predicates
-            predicates["key"] = self.api_key
-            r = requests.get(base_url, params=predicates, timeout=self.timeout)
-            chunk_df = pd.DataFrame(r.json()[1:], columns=r.json()[0])
-            if df.empty:
-                df = chunk_df
+        base_url = "/".join([self.host, str(year), dataset_url])
+
+        # block requests are split by county to keep responses small
+        if for_predicates.startswith('block'):
+            partitions = self.partition_in_predicates(in_predicates)
+        else:
+            partitions = [in_predicates]
+
+        # look up each variable in the cache, only missing variables are requested
+        cached = {}
+        requests_params = []
+        for i, partition in enumerate(partitions):
+            missing = []
+            for variable in variables:
+                df = self.get_cached(year, dataset_url, for_predicates, partition, variable)
+                if df is None:
+                    missing.append(variable)
+                else:
+                    cached.setdefault(i, []).append(df)
+            chunks = [missing[x:x+45] for x in range(0, len(missing), 45)]
+            for chunk in chunks:
+                predicates = {}
+                predicates["get"] = ",".join(chunk)
+                predicates["for"] = for_predicates
+                if partition is not None:
+                    predicates["in"] = partition
+                predicates["key"] = self.api_key
+                requests_params.append((i, chunk, predicates))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            responses = list(executor.map(lambda r: self.request(base_url, r[2]), requests_params))
+
+        fetched = {}
+        for (i, chunk, _), response in zip(requests_params, responses):
+            self.put_cached(year, dataset_url, for_predicates, partitions[i], chunk, response)
+            fetched.setdefault(i, []).append(response)
+        if self.cache is not None:
+            self.cache.evict()
+
+        # join variable chunks on the geography columns, then stack county partitions
+        partition_dfs = [
+            self.join_on_geography(fetched.get(i, []) + cached.get(i, []))
+            for i in range(len(partitions))
+        ]
+        df = pd.concat(partition_dfs, ignore_index=True)
+        return df[variables + [col for col in df.columns if col not in variables]]
+
+    def get_cached(self, year, dataset_url, for_predicates, in_predicates, variable):
+        if self.cache is None:
+            return None
+        key = self.cache.key(year, dataset_url, for_predicates, in_predicates, variable)
+        return self.cache.get(key)
+
+    def put_cached(self, year, dataset_url, for_predicates, in_predicates, chunk, df):
+        # cache each variable of a response separately with its geography columns
+        if self.cache is None:
+            return
+        geo_cols = [col for col in GEO_COLS if col in df.columns]
+        for variable in chunk:
+            key = self.cache.key(year, dataset_url, for_predicates, in_predicates, variable)
+            self.cache.put(key, df[geo_cols + [variable]])
+
+    @staticmethod
+    def join_on_geography(dfs):
+        # joins responses for different variables of the same geographies
+        df = dfs[0]
+        geo_cols = [col for col in GEO_COLS if col in df.columns]
+        for other in dfs[1:]:
+            new_cols = [col for col in other.columns if col not in geo_cols]
+            if other[geo_cols].equals(df[geo_cols]):
+                # same rows in the same order, so the columns can be added directly
+                df = pd.concat([df, other[new_cols]], axis=1)
             else:
-                df.drop(columns=['state', 'county', 'tract'], inplace=True, errors='ignore')
-                df = df.merge(chunk_df, left_index=True, right_index=True)
+                df = df.merge(other, on=geo_cols, how='inner', validate='one_to_one')
         return df
 
     @staticmethod
@@ -38,7 +190,7 @@ class CensusApi:
         are made up of multiple census columns.
         """
         for key, value in variables_dict.items():
-            df[key] = df[value].astype(float).sum(axis=1)
+            df[key] = df[value].astype('int64').sum(axis=1)
             df = df.drop(value, axis=1)
         return df
 
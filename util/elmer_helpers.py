@@ -1,10 +1,64 @@
+import threading
 import pandas as pd
-from shapely import wkt
-import sqlalchemy
-import geopandas as gpd
-import pyodbc
 
-def read_from_elmer_geo(feature_class_name, cols, crs='epsg:2285'):
+# sqlalchemy and geopandas are imported where they are used, so importing this
+# module is cheap. pyodbc is loaded by sqlalchemy for the mssql+pyodbc connections
+
+CONN_STRS = {
+        'Elmer': 'mssql+pyodbc://SQLserver/Elmer?driver=ODBC+Driver+17+for+SQL+Server',
+        'ElmerGeo': 'mssql+pyodbc://SQLserver/ElmerGeo?driver=ODBC+Driver+17+for+SQL+Server',
+}
+GEOMETRY_EXPR = 'Shape.STAsBinary()'
+
+# one pooled engine per database and connection string, shared by every read in the process
+_engines = {}
+_engines_lock = threading.Lock()
+
+def get_engine(database, conn_str=None):
+        """
+        Returns the pooled engine for a database and connection string, creating it on first use.
+
+        Parameters
+        ----------
+        database: 'Elmer' or 'ElmerGeo'
+
+        conn_str: optional connection string to use instead of the PSRC SQL Server 
+                (e.g. a local sqlite database for testing)
+        """
+        import sqlalchemy
+        conn_str = conn_str or CONN_STRS[database]
+        # pyodbc sends inserts as one batch per executemany call instead of a round trip per row
+        options = {'fast_executemany': True} if conn_str.startswith('mssql+pyodbc') else {}
+        key = (database, conn_str)
+        with _engines_lock:
+                if key not in _engines:
+                        _engines[key] = sqlalchemy.create_engine(
+                                conn_str, pool_pre_ping=True, **options)
+                return _engines[key]
+
+def dispose_engines():
+        # closes all pooled connections
+        with _engines_lock:
+                for engine in _engines.values():
+                        engine.dispose()
+                _engines.clear()
+
+def geo_sql(feature_class_name, cols, geometry_expr=GEOMETRY_EXPR):
+        # converts cols list to string for sql query, geometry is read as WKB
+        cols_str = ', '.join(cols)
+        return 'select %s, %s as geometry from %s' % (cols_str, geometry_expr, feature_class_name)
+
+def to_geodataframe(df, crs):
+        # decodes the WKB geometry column with a single vectorized shapely call
+        import geopandas as gpd
+        geometry = gpd.GeoSeries.from_wkb(df.pop('geometry'), crs=crs)
+        gdf = gpd.GeoDataFrame(df, geometry=geometry, crs=crs)
+        cols = [col for col in gdf.columns if col not in 
+                ['Shape', 'GDB_GEOMATTR_DATA', 'SDE_STATE_ID']]
+        return gdf[cols]
+
+def read_from_elmer_geo(feature_class_name, cols, crs='epsg:2285', engine=None, 
+                        geometry_expr=GEOMETRY_EXPR):
         """
         Returns the specified feature class as a geodataframe from ElmerGeo.
 
@@ -16,28 +70,90 @@ def read_from_elmer_geo(feature_class_name, cols, crs='epsg:2285'):
         cols: list of columns to be read from the feature class
 
         crs: coordinate reference system
+
+        engine: optional engine to read from, defaults to the pooled ElmerGeo engine
+
+        geometry_expr: sql expression that returns the geometry as WKB
         """
-        conn_str = 'mssql+pyodbc://SQLserver/ElmerGeo?driver=ODBC+Driver+17+for+SQL+Server'
-        engine = sqlalchemy.create_engine(conn_str)
-        con=engine.connect()
-        # converts cols list to string for sql query
-        cols_str = ', '.join(cols)
+        engine = engine or get_engine('ElmerGeo')
+        with engine.connect() as con:
+                df = pd.read_sql(geo_sql(feature_class_name, cols, geometry_expr), con=con)
+        return to_geodataframe(df, crs)
 
-        df=pd.read_sql('select %s, Shape.STAsText() as geometry from %s' % 
-                        (cols_str, feature_class_name), con=con)
-        con.close()
-        df['geometry'] = df['geometry'].apply(wkt.loads)
-        gdf=gpd.GeoDataFrame(df, geometry='geometry', crs=crs)
-        cols = [col for col in gdf.columns if col not in 
-                ['Shape', 'GDB_GEOMATTR_DATA', 'SDE_STATE_ID']]
-    
-        return gdf[cols]
+def read_from_elmer_geo_chunks(feature_class_name, cols, chunksize, crs='epsg:2285', 
+                               engine=None, geometry_expr=GEOMETRY_EXPR):
+        """
+        Reads the specified feature class from ElmerGeo in chunks and yields each 
+        chunk as a geodataframe, so only one chunk is held in memory at a time.
 
-def read_from_elmer(table_name, columns):
-        conn_str = 'mssql+pyodbc://SQLserver/Elmer?driver=ODBC+Driver+17+for+SQL+Server'
-        engine = sqlalchemy.create_engine(conn_str)
+        Parameters
+        ----------
+        feature_class_name: the name of the featureclass in PSRC's ElmerGeo 
+                        Geodatabase
+
+        cols: list of columns to be read from the feature class
+
+        chunksize: number of rows per chunk
+
+        crs: coordinate reference system
+
+        engine: optional engine to read from, defaults to the pooled ElmerGeo engine
+
+        geometry_expr: sql expression that returns the geometry as WKB
+        """
+        engine = engine or get_engine('ElmerGeo')
+        sql = geo_sql(feature_class_name, cols, geometry_expr)
+        # stream_results fetches rows from the server as chunks are consumed
+        with engine.connect().execution_options(stream_results=True) as con:
+                for df in pd.read_sql(sql, con=con, chunksize=chunksize):
+                        yield to_geodataframe(df, crs)
+
+def read_from_elmer(table_name, columns, engine=None):
+        engine = engine or get_engine('Elmer')
         with engine.connect() as con:
                 cols_str = ', '.join(columns)
                 sql_query = f'select {cols_str} from {table_name}'
                 df = pd.read_sql(sql=sql_query, con=con)
-        return df
\ No newline at end of file
+        return df
+
+def split_table_name(table_name):
+        # 'schema.table' to ('schema', 'table'), tables without a schema use the default schema
+        schema, _, name = table_name.rpartition('.')
+        return schema or None, name
+
+def quote_table(con, schema, name):
+        preparer = con.dialect.identifier_preparer
+        quoted = preparer.quote(name)
+        return f'{preparer.quote_schema(schema)}.{quoted}' if schema else quoted
+
+def write_to_elmer(df, table_name, engine=None, chunksize=10000):
+        """
+        Replaces a table in Elmer with a dataframe. Rows are inserted into a
+        staging table in batches of chunksize (with fast_executemany on SQL Server),
+        then the staging table is swapped in for the table. Everything runs in one
+        transaction, so readers see the old table until the new one is complete
+        and a failed load leaves the old table as it was.
+
+        Parameters
+        ----------
+        df: dataframe to write
+
+        table_name: table in Elmer, e.g. 'control_totals.annual_control_totals'
+
+        engine: optional engine to write to, defaults to the pooled Elmer engine
+
+        chunksize: number of rows per insert batch
+        """
+        engine = engine or get_engine('Elmer')
+        schema, name = split_table_name(table_name)
+        staging = f'{name}_staging'
+        with engine.begin() as con:
+                df.to_sql(staging, con=con, schema=schema, if_exists='replace', index=False,
+                          chunksize=chunksize)
+                con.exec_driver_sql(f'DROP TABLE IF EXISTS {quote_table(con, schema, name)}')
+                if con.dialect.name == 'mssql':
+                        staging_name = f'{schema}.{staging}' if schema else staging
+                        con.exec_driver_sql(f"EXEC sp_rename '{staging_name}', '{name}'")
+                else:
+                        con.exec_driver_sql(f'ALTER TABLE {quote_table(con, schema, staging)} '
+                                            f'RENAME TO {con.dialect.identifier_preparer.quote(name)}')
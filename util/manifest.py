@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import threading
+import pandas as pd
+
+
+class StepRecord:
+    """
+    Records what a step used while it ran: the tables it read and wrote,
+    the input files it loaded and the settings keys it looked up.
+    """
+    def __init__(self):
+        self.reads = set()
+        self.writes = set()
+        self.files = set()
+        self.settings_keys = set()
+
+    def add_read(self, table_name):
+        # tables the step wrote itself are outputs, not inputs
+        if table_name not in self.writes:
+            self.reads.add(table_name)
+
+
+# settings that only change how the pipeline runs (memory, workers, chunking, caching),
+# not what the steps compute, so changing them doesn't make steps re-run
+UNTRACKED_SETTINGS = {
+    'table_cache_mb',
+    'table_schemas',
+    'write_behind',
+    'write_behind_mb',
+    'stream_block_tables',
+    'stream_memory_mb',
+    'partition_workers',
+    'xwalk_incremental',
+    'census_workers',
+    'census_max_retries',
+    'census_requests_per_second',
+    'census_cache',
+    'elmer_workers',
+    'elmer_geo_chunksize',
+    'load_workers',
+    'scenario_workers',
+    'export_chunksize',
+}
+
+
+class TrackedSettings(dict):
+    """
+    Settings dictionary that records which top level keys are looked up
+    while a step record is active. Records are per thread, so steps running
+    at the same time each track their own keys. Keys in UNTRACKED_SETTINGS
+    are never recorded.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._local = threading.local()
+
+    @property
+    def record(self):
+        return getattr(self._local, 'record', None)
+
+    @record.setter
+    def record(self, record):
+        self._local.record = record
+
+    def _track(self, key):
+        record = self.record
+        if record is not None and key not in UNTRACKED_SETTINGS:
+            record.settings_keys.add(key)
+
+    def __getitem__(self, key):
+        self._track(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self._track(key)
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        self._track(key)
+        return super().__contains__(key)
+
+
+def hash_table(df):
+    # content hash of a table, including column names and dtypes
+    h = hashlib.sha256()
+    h.update(json.dumps([list(map(str, df.columns)), list(map(str, df.dtypes))]).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return h.hexdigest()
+
+
+def file_fingerprint(path, previous=None):
+    """
+    Returns the size, modified time and content hash of a file. The content
+    is only re-hashed if the size or modified time changed since the previous fingerprint.
+    """
+    stat = os.stat(path)
+    if previous and previous['size'] == stat.st_size and previous['mtime_ns'] == stat.st_mtime_ns:
+        return previous
+    h = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            h.update(block)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': h.hexdigest()}
+
+
+def config_hash(config):
+    # hash of a settings value, e.g. the settings.yaml entry of an input table
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Manifest:
+    """
+    Keeps the content hash of every table in the pipeline store and the
+    dependencies and fingerprint of every step that has run, in a json file
+    next to the store.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tables = {}
+        self.files = {}
+        self.steps = {}
+        self.loads = {}
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                manifest = json.load(file)
+            self.tables = manifest.get('tables', {})
+            self.files = manifest.get('files', {})
+            self.steps = manifest.get('steps', {})
+            self.loads = manifest.get('loads', {})
+        # hash of what is in the store for each table, behind self.tables while writes are queued
+        self.persisted = dict(self.tables)
+
+    def save(self, unsaved=()):
+        """
+        Writes the manifest to its json file. Tables in unsaved (still queued for the
+        background writer) are saved with the hash of what is in the store, and steps
+        that wrote them are left out, so they re-run if the run is interrupted.
+        """
+        tables = {name: h for name, h in self.tables.items() if name not in unsaved}
+        tables.update({name: self.persisted[name] for name in unsaved if name in self.persisted})
+        steps = {name: step for name, step in self.steps.items() if not set(step['writes']) & set(unsaved)}
+        # write to a temporary file first so an interrupted run can't corrupt the manifest
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump({'tables': tables, 'files': self.files, 'steps': steps,
+                       'loads': self.loads}, file, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def update_table(self, table_name, table_hash, append=False):
+        # returns the new hash of the table
+        if append and table_name in self.tables:
+            # chain the hash of appended rows onto the existing table hash
+            table_hash = hashlib.sha256((self.tables[table_name] + table_hash).encode()).hexdigest()
+        self.tables[table_name] = table_hash
+        return table_hash
+
+    def mark_persisted(self, table_name, table_hash):
+        # record that a table with this hash was written to the store
+        self.persisted[table_name] = table_hash
+
+    def update_file(self, path):
+        self.files[path] = file_fingerprint(path, self.files.get(path))
+        return self.files[path]
+
+    def update_load(self, table_name, path, config):
+        # record the file and settings a table was loaded from
+        self.loads[table_name] = {
+            'path': str(path),
+            'sha256': self.update_file(path)['sha256'],
+            'config': config_hash(config),
+            'table': self.tables.get(table_name),
+        }
+
+    def is_load_current(self, table_name, path, config):
+        """
+        Returns True if a table was last loaded from the same file contents with the
+        same settings and hasn't been overwritten since. The file is only re-hashed
+        if its size or modified time changed.
+        """
+        load = self.loads.get(table_name)
+        if load is None or load['path'] != str(path) or not os.path.exists(path):
+            return False
+        return (load['sha256'] == self.update_file(path)['sha256']
+                and load['config'] == config_hash(config)
+                and load['table'] == self.tables.get(table_name))
+
+    def fingerprint(self, reads, files, settings, settings_keys):
+        """
+        Returns a hash of the current state of a step's inputs: the hashes of the
+        tables it reads, the contents of its input files and the values of its settings keys.
+        """
+        state = {
+            'tables': {name: self.tables.get(name) for name in sorted(reads)},
+            'files': {path: file_fingerprint(path, self.files.get(path))['sha256']
+                      if os.path.exists(path) else None for path in sorted(files)},
+            'settings': {key: dict.get(settings, key) for key in sorted(settings_keys)
+                         if key not in UNTRACKED_SETTINGS},
+        }
+        return hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest()
+
+    def update_step(self, step_name, record, settings):
+        for path in record.files:
+            self.update_file(path)
+        self.steps[step_name] = {
+            'reads': sorted(record.reads),
+            'writes': sorted(record.writes),
+            'files': sorted(record.files),
+            'settings_keys': sorted(record.settings_keys),
+            'fingerprint': self.fingerprint(record.reads, record.files, settings, record.settings_keys),
+        }
+
+    def is_step_current(self, step_name, settings):
+        # a step is current if it ran before and none of its inputs changed since
+        step = self.steps.get(step_name)
+        if step is None:
+            return False
+        fingerprint = self.fingerprint(step['reads'], step['files'], settings, step['settings_keys'])
+        return fingerprint == step['fingerprint']
@@ -0,0 +1,32 @@
+import numpy as np
+
+
+# 15 digit block geoids are 2 digit state, 3 digit county, 6 digit tract and 4 digit block
+BLOCK_COUNTY_DIVISOR = 10 ** 10
+
+
+def block_county_ids(block_ids):
+    # state and county fips of each block geoid, e.g. 53033 for King County
+    return np.asarray(block_ids, dtype='int64') // BLOCK_COUNTY_DIVISOR
+
+
+def split_by_county(df, id_col):
+    """
+    Splits a block level table into one table per county, in county id order.
+    Rows keep their order and index within each county, so results computed per
+    county can be combined in the same order on every run.
+
+    Parameters
+    ----------
+    df: block level table
+
+    id_col: block geoid column
+    """
+    counties = block_county_ids(df[id_col])
+    return {int(county_id): part for county_id, part in df.groupby(counties, sort=True)}
+
+
+def run_partition(args):
+    # process pool worker
+    func, func_args = args
+    return func(*func_args)
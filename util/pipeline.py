@@ -1,9 +1,21 @@
 import pandas as pd
 import yaml
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import os
-import geopandas as gpd
-from shapely.wkt import loads
+import queue
+import threading
+import time
+from .storage import get_storage_backend, filter_columns, filter_mask
+from .manifest import Manifest, StepRecord, TrackedSettings, hash_table
+from .aggregation import Incidence
+from .schema import get_table_schema, compact_dtypes, restore_dtypes, match_dtypes
+from .partitions import run_partition
+
+
+GEOMETRY_COL = 'geometry_wkb'
 
 
 class Pipeline:
@@ -14,12 +26,70 @@ class Pipeline:
         self.settings_path = settings_path
         
         with open(f"{self.settings_path}/settings.yaml", 'r') as file:
-            self.settings = yaml.safe_load(file)
+            self.settings = TrackedSettings(yaml.safe_load(file))
 
         # create data and output directories if they don't exist
         create_directory(path=self.get_data_dir())
         create_directory(path=self.get_output_dir())
 
+        # store session: one open storage backend and an LRU cache of decoded tables
+        self.store = get_storage_backend(self.get_storage_backend_name(), self.get_data_dir())
+        self._table_cache = OrderedDict()
+        self._table_cache_bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # crosswalks and lookups compiled into index arrays for aggregation
+        self._incidences = {}
+        # compact dtypes of each table, see table_schemas in settings.yaml, and the dtypes its
+        # schema columns were saved with, which rows appended to it are converted to
+        self._schemas = {}
+        self._stored_dtypes = {}
+
+        # table hashes and step fingerprints used to skip unchanged steps
+        self.manifest = Manifest(f"{self.get_data_dir()}/pipeline_manifest.json")
+
+        # steps running in parallel share the pipeline: cache and manifest access is
+        # serialized with a lock, store access with a second one, and each thread keeps its
+        # own step record. _store_lock is never waited on while holding _lock, so reads from
+        # memory and saves don't wait on the background writer or on reads from the store
+        self._lock = threading.RLock()
+        self._store_lock = threading.RLock()
+        self._local = threading.local()
+
+        # write-behind: saved tables are queued for a background thread that writes them to the
+        # store. _pending counts the queued writes of each table, _written is notified as they finish.
+        # _queued_bytes is the memory held by the queue, save_table waits while it is over write_behind_mb
+        self._write_queue = queue.Queue()
+        self._writer = None
+        self._pending = {}
+        self._queued_bytes = 0
+        self._failed = set()
+        self._write_error = None
+        self._written = threading.Condition(self._lock)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def step_record(self):
+        return getattr(self._local, 'step_record', None)
+
+    @step_record.setter
+    def step_record(self, record):
+        self._local.step_record = record
+
+    @property
+    def step_profile(self):
+        # time and table reads/writes of the running step, set when the run is profiled
+        return getattr(self._local, 'step_profile', None)
+
+    @step_profile.setter
+    def step_profile(self, profile):
+        self._local.step_profile = profile
+
     def get_settings_path(self):
         # Returns the path to the settings directory
         return self.settings_path
@@ -44,26 +114,554 @@ class Pipeline:
         # Returns a list of output table names from settings.yaml
         return self.settings.get('output_table_list', [])
 
-    def get_table(self, table_name):
-        with pd.HDFStore(f"{self.get_data_dir()}/pipeline.h5", mode='r') as h5store:
-            return h5store.get(table_name)
+    def get_storage_backend_name(self):
+        # Returns the pipeline store backend from settings.yaml ('hdf5' or 'parquet')
+        return self.settings.get('storage_backend', 'hdf5')
+
+    def get_store_path(self):
+        # Returns the path to the pipeline store (HDF5 file or parquet directory)
+        return self.store.path
+
+    def get_table_cache_max_bytes(self):
+        # Returns the table cache size limit from settings.yaml (in MB, default 512)
+        return int(self.settings.get('table_cache_mb', 512) * 1024 ** 2)
+
+    def get_stream_memory_bytes(self):
+        # Returns the memory budget for one chunk of a streamed table from settings.yaml (in MB, default 256)
+        return int(self.settings.get('stream_memory_mb', 256) * 1024 ** 2)
+
+    def get_write_behind(self):
+        # Returns whether saved tables are written to the store on a background thread from settings.yaml (default True)
+        return self.settings.get('write_behind', True)
+
+    def get_write_behind_max_bytes(self):
+        # Returns the memory limit for tables queued for the background writer from settings.yaml (in MB, default 512)
+        return int(self.settings.get('write_behind_mb', 512) * 1024 ** 2)
+
+    def get_partition_workers(self):
+        # Returns the number of processes used for block level work split by county from settings.yaml (default 1)
+        return self.settings.get('partition_workers', 1)
+
+    def get_table_schema(self, table_name):
+        """
+        Returns the compact column dtypes declared for a table in table_schemas
+        in settings.yaml. table_schemas is an untracked setting, since dtypes only change
+        how tables are stored, so schema changes don't make steps re-run.
+        """
+        if table_name not in self._schemas:
+            self._schemas[table_name] = get_table_schema(self.settings.get('table_schemas'), table_name)
+        return self._schemas[table_name]
+
+    def close(self):
+        # waits for the background writer, closes the store, reports cache stats and clears the table cache
+        try:
+            self.flush()
+        finally:
+            if self._writer is not None:
+                self._write_queue.put(None)
+                self._writer.join()
+                self._writer = None
+            with self._lock:
+                with self._store_lock:
+                    self.store.close()
+                self.manifest.save(unsaved=self._unsaved_tables())
+                if self.cache_hits or self.cache_misses:
+                    self.report_cache_stats()
+                self.clear_cache()
+
+    def get_table(self, table_name, columns=None, filters=None):
+        """
+        Returns a table from the pipeline store.
+
+        Parameters
+        ----------
+        table_name: name of the table in the store
+
+        columns: optional list of columns to read
+
+        filters: optional list of (column, op, value) row filters, 
+                e.g. [('county_id', '==', 53033)]
+        """
+        if self.step_record is not None:
+            self.step_record.add_read(table_name)
+        start = time.perf_counter()
+        df, cache_hit = self._read_table(table_name, columns, filters)
+        if self.step_profile is not None:
+            self.step_profile.add_io('read', table_name, df, time.perf_counter() - start, cache_hit)
+        return df
+
+    def _read_table(self, table_name, columns=None, filters=None):
+        # Returns a table from the cache or the store, and whether it came from the cache.
+        # Tables are cached with their compact dtypes and restored on the way out
+        schema = self.get_table_schema(table_name)
+        with self._lock:
+            if table_name in self._table_cache:
+                self.cache_hits += 1
+                self._table_cache.move_to_end(table_name)
+                df = self._table_cache[table_name][0]
+                if filters:
+                    # filter on restored values, e.g. range filters on a categorical id
+                    restored = restore_dtypes(share_frame(df[filter_columns(filters)]), schema)
+                    df = df[filter_mask(restored, filters).to_numpy()]
+                # callers can modify the table without touching the cache, with copy-on-write
+                # the data is only copied if they do
+                df = share_frame(df[list(columns)] if columns is not None else df)
+                return restore_dtypes(df, schema), True
+            self.cache_misses += 1
+
+        # a saved table that is no longer in memory is read back once it is in the store.
+        # the store is read without holding _lock, so other threads' cache hits and saves
+        # don't wait for the read (or for the writer to release the store)
+        self._wait_for_writes(table_name)
+        if columns is not None or filters:
+            # projected reads only load what is needed and are not cached.
+            # filters on columns with compact dtypes run after the dtypes are restored, like
+            # on a cache hit, the other filters are applied by the store while reading
+            filters = filters or []
+            restored_filters = [f for f in filters if f[0] in schema]
+            store_filters = [f for f in filters if f[0] not in schema]
+            read_cols = columns
+            if columns is not None and restored_filters:
+                read_cols = list(dict.fromkeys(list(columns) + filter_columns(restored_filters)))
+            with self._store_lock:
+                df = self.store.get(table_name, columns=read_cols, filters=store_filters or None)
+            df = restore_dtypes(df, schema)
+            if restored_filters:
+                df = df[filter_mask(df, restored_filters).to_numpy()]
+                if columns is not None:
+                    df = df[list(columns)]
+            return df, False
+
+        with self._lock:
+            table_hash = self.manifest.tables.get(table_name)
+        with self._store_lock:
+            df = self.store.get(table_name)
+        with self._lock:
+            # don't cache over a version of the table saved while it was being read
+            if (table_name not in self._table_cache and table_name not in self._pending
+                    and self.manifest.tables.get(table_name) == table_hash):
+                self._cache_table(table_name, df)
+        return restore_dtypes(share_frame(df), schema), False
+
+    def get_chunk_rows(self, table_name, columns=None):
+        """
+        Returns the number of rows per chunk that keeps a streamed table within
+        stream_memory_mb, estimated from the size of the first rows of the table.
+        Half of the budget is left for the temporary arrays made while processing a chunk.
+        """
+        self._wait_for_writes(table_name)
+        with self._store_lock:
+            sample = self.store.head(table_name, columns=columns)
+        if len(sample) == 0:
+            return 1
+        row_bytes = sample.memory_usage(index=True, deep=True).sum() / len(sample)
+        return max(int(self.get_stream_memory_bytes() / 2 / row_bytes), 1)
+
+    def iter_table(self, table_name, columns=None, chunksize=None):
+        """
+        Yields a table from the pipeline store in chunks of rows, so only one
+        chunk is in memory at a time. Chunks are not added to the table cache.
+
+        Parameters
+        ----------
+        table_name: name of the table in the store
+
+        columns: optional list of columns to read
+
+        chunksize: optional number of rows per chunk, by default sized to fit stream_memory_mb
+        """
+        if self.step_record is not None:
+            self.step_record.add_read(table_name)
+        with self._lock:
+            cached = self._table_cache.get(table_name)
+        if cached is not None:
+            # already in memory, slice the cached table instead of reading it again
+            df = cached[0] if columns is None else cached[0][list(columns)]
+            chunksize = chunksize or len(df) or 1
+            schema = self.get_table_schema(table_name)
+            for start in range(0, len(df), chunksize):
+                chunk = restore_dtypes(share_frame(df.iloc[start:start + chunksize]), schema)
+                if self.step_profile is not None:
+                    self.step_profile.add_io('read', table_name, chunk, 0.0, cache_hit=True)
+                yield chunk
+            return
+
+        chunksize = chunksize or self.get_chunk_rows(table_name, columns)
+        with self._store_lock:
+            chunks = self.store.iter_chunks(table_name, columns=columns, chunksize=chunksize)
+        while True:
+            # read each chunk under the lock, other steps can use the store in between
+            start = time.perf_counter()
+            with self._store_lock:
+                chunk = next(chunks, None)
+            if chunk is None:
+                return
+            chunk = restore_dtypes(chunk, self.get_table_schema(table_name))
+            if self.step_profile is not None:
+                self.step_profile.add_io('read', table_name, chunk, time.perf_counter() - start)
+            yield chunk
+
+    def save_table(self, table_name, df, append=False, data_columns=None, min_itemsize=None):
+        """
+        Saves a table to the pipeline store.
+
+        Parameters
+        ----------
+        table_name: name of the table in the store
+
+        df: dataframe to save
+
+        append: if True, rows are appended to an existing table instead of replacing it
+
+        data_columns: optional list of columns that get_table filters are used on, e.g. ['year'].
+                Filters on these columns are applied while reading instead of after
+
+        min_itemsize: optional dictionary of string column sizes for tables that rows will be
+                appended to, e.g. {'geometry_wkb': 20000}. Can be empty, see HDF5Backend.put
+
+        The table's schema in table_schemas is applied before saving. Rows appended to a
+        table are converted to the dtypes it was first saved with instead, so every chunk
+        has the same dtypes.
+
+        Saved tables are kept in the table cache for the steps that read them next. With
+        write_behind in settings.yaml they are written to the store on a background thread,
+        so the step doesn't wait for them to be serialized, unless the tables already queued
+        use more than write_behind_mb (e.g. chunks of a streamed table saved faster than they
+        are written). close() and flush() wait for every write.
+        """
+        if self.step_record is not None:
+            self.step_record.writes.add(table_name)
+        start = time.perf_counter()
+        table_hash = hash_table(df)
+        schema = self.get_table_schema(table_name)
+        stored_dtypes = self._get_stored_dtypes(table_name, schema) if append and schema else None
+        if stored_dtypes is not None:
+            df = match_dtypes(df, stored_dtypes, table_name)
+        elif schema:
+            df = compact_dtypes(df, schema)
+            with self._lock:
+                self._stored_dtypes[table_name] = {col: df[col].dtype for col in schema if col in df.columns}
+        # the step can keep modifying its dataframe without changing the saved table
+        df = share_frame(df)
+        write_behind = self.get_write_behind()
+        size = int(df.memory_usage(deep=True).sum()) if write_behind else 0
+        with self._lock:
+            if write_behind:
+                # wait for the writer to make room, a table larger than the limit is queued on its own
+                max_bytes = self.get_write_behind_max_bytes()
+                self._written.wait_for(lambda: not self._queued_bytes or self._queued_bytes + size <= max_bytes)
+            self._raise_write_error()
+            self._invalidate_table(table_name)
+            table_hash = self.manifest.update_table(table_name, table_hash, append=append)
+            if not append:
+                self._cache_table(table_name, df)
+            if write_behind:
+                self._pending[table_name] = self._pending.get(table_name, 0) + 1
+                self._queued_bytes += size
+                self._start_writer()
+                self._write_queue.put((size, (table_name, df, append, data_columns, min_itemsize, table_hash)))
+        if not write_behind:
+            self._write_table(table_name, df, append, data_columns, min_itemsize, table_hash)
+        if self.step_profile is not None:
+            self.step_profile.add_io('write', table_name, df, time.perf_counter() - start)
+
+    def _get_stored_dtypes(self, table_name, schema):
+        # dtypes of the schema columns of a saved table, from its first save in this session or
+        # from the store. None if the table doesn't exist yet
+        with self._lock:
+            dtypes = self._stored_dtypes.get(table_name)
+        if dtypes is not None or not self.table_exists(table_name):
+            return dtypes
+        self._wait_for_writes(table_name)
+        with self._store_lock:
+            sample = self.store.head(table_name, n=1)
+        dtypes = {col: sample[col].dtype for col in schema if col in sample.columns}
+        with self._lock:
+            return self._stored_dtypes.setdefault(table_name, dtypes)
+
+    def _write_table(self, table_name, df, append, data_columns, min_itemsize, table_hash):
+        # writes a saved table to the store and records that the store has it
+        with self._store_lock:
+            if append:
+                print(f"Appending {len(df)} rows to table {table_name} in {self.store.name} store...")
+                self.store.append(table_name, df, min_itemsize=min_itemsize)
+            else:
+                print(f"Saving table {table_name} to {self.store.name} store...")
+                self.store.put(table_name, df, data_columns=data_columns, min_itemsize=min_itemsize)
+        with self._lock:
+            self.manifest.mark_persisted(table_name, table_hash)
+
+    def _start_writer(self):
+        # background thread that writes queued tables to the store in the order they were saved
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._run_writer, name='pipeline-writer', daemon=True)
+            self._writer.start()
 
-    def save_table(self, table_name, df):
-        print(f"Saving table {table_name} to HDF5 store...")
-        with pd.HDFStore(f"{self.get_data_dir()}/pipeline.h5", mode='a') as h5store:
-            h5store.put(table_name, df, format='table')
+    def _run_writer(self):
+        while True:
+            item = self._write_queue.get()
+            if item is None:
+                return
+            size, args = item
+            table_name = args[0]
+            try:
+                # after a failed write the queued writes are dropped, the error is raised in the step
+                if self._write_error is None:
+                    self._write_table(*args)
+            except Exception as e:
+                with self._lock:
+                    self._write_error = e
+            finally:
+                with self._written:
+                    if self._write_error is not None:
+                        self._failed.add(table_name)
+                    self._pending[table_name] -= 1
+                    self._queued_bytes -= size
+                    if not self._pending[table_name]:
+                        del self._pending[table_name]
+                    self._written.notify_all()
 
-    def save_geodataframe(self, name, gdf):
-        gdf['geometry_wkt'] = gdf['geometry'].apply(lambda geom: geom.wkt)
-        gdf_to_save = gdf.drop(columns=['geometry'])
-        self.save_table(name, gdf_to_save)
+    def _wait_for_writes(self, table_name=None):
+        # blocks until the queued writes of a table (or of every table) are in the store
+        with self._written:
+            if table_name is None:
+                self._written.wait_for(lambda: not self._pending)
+            else:
+                self._written.wait_for(lambda: table_name not in self._pending)
+            self._raise_write_error()
 
-    def get_geodataframe(self, name,crs='epsg:2285'):
-        df = self.get_table(name)
-        df['geometry'] = df['geometry_wkt'].apply(loads)
-        gdf = gpd.GeoDataFrame(df, geometry='geometry', crs=crs)
-        gdf = gdf.drop(columns=['geometry_wkt'])
-        return gdf
+    def _raise_write_error(self):
+        if self._write_error is not None:
+            raise RuntimeError(
+                f"Writing {', '.join(sorted(self._failed))} to the {self.store.name} store failed"
+            ) from self._write_error
+
+    def _unsaved_tables(self):
+        # tables that are saved in memory but not yet (or not successfully) written to the store
+        with self._lock:
+            return set(self._pending) | self._failed
+
+    def flush(self):
+        """
+        Waits until the background writer has written every saved table to the store.
+        Raises an error if any write failed.
+        """
+        self._wait_for_writes()
+
+    def _cache_table(self, table_name, df):
+        # add table to the LRU cache, evicting least recently used tables to stay under the size limit
+        size = int(df.memory_usage(deep=True).sum())
+        max_bytes = self.get_table_cache_max_bytes()
+        if size > max_bytes:
+            return
+        while self._table_cache and self._table_cache_bytes + size > max_bytes:
+            _, (_, evicted_size) = self._table_cache.popitem(last=False)
+            self._table_cache_bytes -= evicted_size
+        self._table_cache[table_name] = (df, size)
+        self._table_cache_bytes += size
+
+    def _invalidate_table(self, table_name):
+        # drop a table and the incidences compiled from it after it is overwritten
+        cached = self._table_cache.pop(table_name, None)
+        if cached is not None:
+            self._table_cache_bytes -= cached[1]
+        for key in [key for key in self._incidences if key[0] == table_name]:
+            del self._incidences[key]
+
+    def get_incidence(self, table_name, src_col, dst_cols):
+        """
+        Returns a crosswalk or lookup table compiled into an Incidence, for
+        aggregating tables keyed on src_col to dst_cols. Compiled once per 
+        pipeline session and reused until the table is saved again.
+
+        Parameters
+        ----------
+        table_name: name of the crosswalk/lookup table in the store
+
+        src_col: source id column, e.g. the block id
+
+        dst_cols: destination key column or list of columns, e.g. 'control_id'
+        """
+        dst_cols = [dst_cols] if isinstance(dst_cols, str) else list(dst_cols)
+        key = (table_name, src_col, tuple(dst_cols))
+        with self._lock:
+            incidence = self._incidences.get(key)
+            table_hash = self.manifest.tables.get(table_name)
+        if incidence is not None:
+            if self.step_record is not None:
+                self.step_record.add_read(table_name)
+            return incidence
+        # compiled without holding _lock, the table may have to be read from the store
+        df = self.get_table(table_name, columns=[src_col] + dst_cols)
+        incidence = Incidence(df[src_col], df[dst_cols])
+        with self._lock:
+            # only kept if the table wasn't saved again while it was compiled
+            if self.manifest.tables.get(table_name) == table_hash:
+                incidence = self._incidences.setdefault(key, incidence)
+        return incidence
+
+    def map_partitions(self, func, partitions):
+        """
+        Runs func once per partition of block level work, e.g. per county, in a
+        process pool if partition_workers in settings.yaml is more than 1. Returns a
+        dictionary of partition key to result, in the order of partitions however
+        the workers finish, so merged results are the same on every run.
+
+        Parameters
+        ----------
+        func: module level function, so it can be sent to the worker processes
+
+        partitions: dictionary of partition key to a tuple of arguments for func
+        """
+        keys = list(partitions)
+        workers = min(self.get_partition_workers(), len(keys))
+        if workers <= 1:
+            return {key: func(*partitions[key]) for key in keys}
+        # spawned workers don't inherit the background writer thread or open store
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            results = executor.map(run_partition, [(func, partitions[key]) for key in keys])
+            return dict(zip(keys, results))
+
+    def table_exists(self, table_name):
+        # True if a table is in the store or queued to be written to it
+        with self._lock:
+            if table_name in self._pending:
+                return True
+        with self._store_lock:
+            return self.store.exists(table_name)
+
+    def get_table_columns(self, table_name):
+        # Returns the column names of a table without reading it
+        with self._lock:
+            cached = self._table_cache.get(table_name)
+        if cached is not None:
+            return list(cached[0].columns)
+        self._wait_for_writes(table_name)
+        with self._store_lock:
+            return self.store.get_columns(table_name)
+
+    def clear_cache(self):
+        self._table_cache.clear()
+        self._incidences.clear()
+        self._table_cache_bytes = 0
+
+    def get_cache_stats(self):
+        # Returns table cache hit/miss counts and current cache size
+        return {
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'tables': len(self._table_cache),
+            'bytes': self._table_cache_bytes,
+        }
+
+    def report_cache_stats(self):
+        stats = self.get_cache_stats()
+        print(f"Table cache: {stats['hits']} hits, {stats['misses']} misses, "
+              f"{stats['tables']} tables cached ({stats['bytes'] / 1024 ** 2:.1f} MB)")
+
+    def start_step_record(self):
+        # start recording the tables, files and settings a step uses
+        self.step_record = StepRecord()
+        self.settings.record = self.step_record
+
+    def end_step_record(self, step_name):
+        # save what the step used to the manifest
+        with self._lock:
+            self.manifest.update_step(step_name, self.step_record, self.settings)
+            self.manifest.save(unsaved=self._unsaved_tables())
+        self.step_record = None
+        self.settings.record = None
+
+    def register_input_file(self, path):
+        # record a file read by the current step, so the step re-runs when the file changes
+        if self.step_record is not None:
+            self.step_record.files.add(str(path))
+
+    def is_file_load_current(self, table_name, path, config):
+        """
+        Returns True if a table in the store was loaded from a file that hasn't changed
+        since (same size and modified time, or same content hash) with the same settings.
+        A table that is still current counts as written by the current step.
+
+        Parameters
+        ----------
+        table_name: name of the table in the store
+
+        path: input file the table is loaded from
+
+        config: settings used to load the table, e.g. its entry in settings.yaml
+        """
+        current = self.table_exists(table_name)
+        if current:
+            with self._lock:
+                current = self.manifest.is_load_current(table_name, path, config)
+        if current and self.step_record is not None:
+            self.step_record.writes.add(table_name)
+        return current
+
+    def record_file_load(self, table_name, path, config):
+        # record the file and settings a table was just loaded from, call after save_table
+        with self._lock:
+            self.manifest.update_load(table_name, path, config)
+
+    def get_geometry_precision(self):
+        # Returns the grid size geometries are snapped to before saving from settings.yaml (None keeps full precision)
+        return self.settings.get('geometry_precision')
+
+    def encode_geometry(self, gdf):
+        """
+        Returns the attribute columns of a geodataframe with the geometry encoded as 
+        WKB in a geometry_wkb column. The HDF5 backend stores hex WKB since PyTables 
+        string columns can't hold raw bytes.
+        """
+        geometry = gdf.geometry
+        grid_size = self.get_geometry_precision()
+        if grid_size:
+            geometry = geometry.set_precision(grid_size)
+        df = pd.DataFrame(gdf.drop(columns=[gdf.geometry.name]))
+        df[GEOMETRY_COL] = geometry.to_wkb(hex=not self.store.binary_geometry)
+        return df
+
+    def save_geodataframe(self, name, gdf, append=False, min_itemsize=None):
+        self.save_table(name, self.encode_geometry(gdf), append=append, min_itemsize=min_itemsize)
+
+    def get_geodataframe(self, name, crs='epsg:2285', columns=None):
+        """
+        Returns a geodataframe from the pipeline store.
+
+        Parameters
+        ----------
+        name: name of the table in the store
+
+        crs: coordinate reference system
+
+        columns: optional list of attribute columns to read along with the geometry
+        """
+        if columns is not None:
+            columns = list(columns) + [GEOMETRY_COL]
+        return self.decode_geometry(self.get_table(name, columns=columns), crs=crs)
+
+    def decode_geometry(self, df, crs='epsg:2285'):
+        # Returns a geodataframe from a table read with its encoded geometry column
+        # (geopandas is imported here so steps without geometries don't load it)
+        import geopandas as gpd
+        if GEOMETRY_COL in df.columns:
+            geometry = gpd.GeoSeries.from_wkb(df.pop(GEOMETRY_COL), crs=crs)
+        else:
+            # tables saved before geometries were stored as WKB
+            geometry = gpd.GeoSeries.from_wkt(df.pop('geometry_wkt'), crs=crs)
+        return gpd.GeoDataFrame(df, geometry=geometry, crs=crs)
+
+    def get_geodataframe_attributes(self, name, columns=None):
+        """
+        Returns the attribute columns of a stored geodataframe as a dataframe,
+        without reading or decoding any geometry.
+        """
+        if columns is None:
+            columns = [col for col in self.get_table_columns(name) 
+                       if col not in [GEOMETRY_COL, 'geometry_wkt']]
+        return self.get_table(name, columns=columns)
 
     def fill_nan_values(self, df):
         if 'nan_fill' in self.settings:
@@ -80,7 +678,29 @@ class Pipeline:
         if 'id_col' in table:
             id_col = table['id_col']
             df[id_col] = df[id_col].astype('int64')
-            return df
+        return df
+
+
+def copy_on_write_enabled():
+    # pandas 3 always copies on write, pandas 2 only with the mode.copy_on_write option
+    if int(pd.__version__.split('.')[0]) >= 3:
+        return True
+    return pd.get_option('mode.copy_on_write') is True
+
+
+def enable_copy_on_write():
+    """
+    Turns on pandas copy-on-write, so tables are handed between steps and the table
+    cache without copying: data is only copied when a dataframe sharing it is modified.
+    """
+    if not copy_on_write_enabled():
+        pd.set_option('mode.copy_on_write', True)
+
+
+def share_frame(df):
+    # Returns a dataframe that can be modified without changing df. A shallow copy with
+    # copy-on-write enabled, otherwise a full copy
+    return df.copy(deep=not copy_on_write_enabled())
 
 
 def create_directory(path_parts: list=None, path: str=None) -> Path:
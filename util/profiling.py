@@ -0,0 +1,224 @@
+import datetime
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+
+def get_rss_mb():
+    # current resident set size of the process, None where /proc isn't available
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError):
+        return None
+
+
+def reset_peak_rss():
+    # resets the peak RSS of the process (linux only), returns False if it can't be reset
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_rss_mb():
+    # peak RSS since the last reset (VmHWM on linux), otherwise the peak for the whole process
+    try:
+        with open('/proc/self/status', 'r') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on linux and bytes on macos
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+
+class StepProfile:
+    """
+    Time, memory and table reads/writes of one step run.
+    """
+    def __init__(self, step_name, reset_peak=True):
+        self.step_name = step_name
+        self.status = 'running'
+        self.reason = None
+        self.tables = {}
+        self.lock = threading.Lock()
+        # with steps running at the same time the peak is shared, so it isn't reset
+        self.peak_is_per_step = reset_peak and reset_peak_rss()
+        self.rss_start_mb = get_rss_mb()
+        self.start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        self.seconds = None
+        self.cpu_seconds = None
+        self.peak_rss_mb = None
+        self.rss_end_mb = None
+
+    def add_io(self, op, table_name, df, seconds, cache_hit=False):
+        """
+        Adds a table read or write to the step.
+
+        Parameters
+        ----------
+        op: 'read' or 'write'
+
+        table_name: name of the table in the store
+
+        df: dataframe that was read or written
+
+        seconds: time spent in get_table/save_table
+
+        cache_hit: True if the read was served from the table cache
+        """
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        with self.lock:
+            io = self.tables.setdefault((op, table_name), {
+                'op': op, 'table': table_name, 'calls': 0, 'rows': 0, 'columns': 0,
+                'bytes': 0, 'seconds': 0.0, 'cache_hits': 0,
+            })
+            io['calls'] += 1
+            io['rows'] += len(df)
+            io['columns'] = max(io['columns'], len(df.columns))
+            io['bytes'] += nbytes
+            io['seconds'] += seconds
+            io['cache_hits'] += int(cache_hit)
+
+    def finish(self, status):
+        # cpu time is for the thread running the step, so parallel steps don't count each other
+        self.status = status
+        self.seconds = time.perf_counter() - self.start
+        self.cpu_seconds = time.thread_time() - self.cpu_start
+        self.peak_rss_mb = get_peak_rss_mb()
+        self.rss_end_mb = get_rss_mb()
+
+    def totals(self, op, key):
+        return sum(io[key] for io in self.tables.values() if io['op'] == op)
+
+    def to_dict(self):
+        def mb(value):
+            return round(value, 1) if value is not None else None
+        return {
+            'step': self.step_name,
+            'status': self.status,
+            'reason': self.reason,
+            'seconds': round(self.seconds, 3) if self.seconds is not None else None,
+            'cpu_seconds': round(self.cpu_seconds, 3) if self.cpu_seconds is not None else None,
+            'rss_start_mb': mb(self.rss_start_mb),
+            'rss_end_mb': mb(self.rss_end_mb),
+            'peak_rss_mb': mb(self.peak_rss_mb),
+            'peak_is_per_step': self.peak_is_per_step,
+            'rows_in': self.totals('read', 'rows'),
+            'rows_out': self.totals('write', 'rows'),
+            'bytes_in': self.totals('read', 'bytes'),
+            'bytes_out': self.totals('write', 'bytes'),
+            'tables': [dict(io, seconds=round(io['seconds'], 3)) for io in self.tables.values()],
+        }
+
+
+class RunReport:
+    """
+    Collects a StepProfile for every step of a run and writes them to a json
+    run report. Created by run.py and passed to the steps in the pypyr context
+    as 'run_report'.
+
+    Parameters
+    ----------
+    profiler: optional 'cprofile' or 'pyinstrument' to profile every step, profiles
+            are written to <output_dir>/profiles
+
+    parallel: True if steps can run at the same time (peak RSS can't be measured per step)
+    """
+    def __init__(self, profiler=None, parallel=False):
+        if profiler not in [None, 'cprofile', 'pyinstrument']:
+            raise ValueError("profiler must be: 'cprofile' or 'pyinstrument'")
+        self.profiler = profiler
+        self.parallel = parallel
+        self.steps = []
+        self.output_dir = 'output'
+        self.started = datetime.datetime.now()
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def start_step(self, step_name, output_dir):
+        profile = StepProfile(step_name, reset_peak=not self.parallel)
+        with self.lock:
+            self.output_dir = output_dir
+            self.steps.append(profile)
+        return profile
+
+    def skip_step(self, step_name, output_dir):
+        profile = StepProfile(step_name, reset_peak=False)
+        profile.finish('skipped')
+        with self.lock:
+            self.output_dir = output_dir
+            self.steps.append(profile)
+
+    def start_profiler(self):
+        # Returns a started cProfile/pyinstrument profiler for a step, or None
+        if self.profiler == 'cprofile':
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+        if self.profiler == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError as e:
+                raise ImportError("--profile pyinstrument requires pyinstrument (pip install pyinstrument)") from e
+            profiler = Profiler()
+            profiler.start()
+            return profiler
+        return None
+
+    def stop_profiler(self, profiler, step_name):
+        # stops a step profiler and writes its output to <output_dir>/profiles
+        if profiler is None:
+            return
+        profile_dir = f"{self.output_dir}/profiles"
+        os.makedirs(profile_dir, exist_ok=True)
+        if self.profiler == 'cprofile':
+            profiler.disable()
+            path = f"{profile_dir}/{step_name}.prof"
+            profiler.dump_stats(path)
+        else:
+            profiler.stop()
+            path = f"{profile_dir}/{step_name}.html"
+            with open(path, 'w') as file:
+                file.write(profiler.output_html())
+        print(f"Wrote {self.profiler} profile of {step_name} to {path}")
+
+    def to_dict(self):
+        return {
+            'started': self.started.isoformat(timespec='seconds'),
+            'seconds': round(time.perf_counter() - self.start, 3),
+            'parallel': self.parallel,
+            'steps': [step.to_dict() for step in self.steps],
+        }
+
+    def save(self, path=None):
+        # writes the report to <output_dir>/run_report.json, returns the path
+        path = path or f"{self.output_dir}/run_report.json"
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file, indent=1)
+        return path
+
+    def print_summary(self):
+        print("\nRun summary:")
+        print(f"{'step':<40}{'status':>9}{'wall s':>9}{'cpu s':>9}{'peak MB':>9}"
+              f"{'rows in':>12}{'rows out':>12}{'MB in':>9}{'MB out':>9}")
+        for step in self.steps:
+            s = step.to_dict()
+            if s['status'] == 'skipped':
+                print(f"{s['step']:<40}{s['status']:>9}")
+                continue
+            peak = f"{s['peak_rss_mb']:.0f}" if s['peak_rss_mb'] is not None else ''
+            print(f"{s['step']:<40}{s['status']:>9}{s['seconds']:>9.1f}{s['cpu_seconds']:>9.1f}{peak:>9}"
+                  f"{s['rows_in']:>12,}{s['rows_out']:>12,}"
+                  f"{s['bytes_in'] / 1024 ** 2:>9.1f}{s['bytes_out'] / 1024 ** 2:>9.1f}")
+        print(f"Total {time.perf_counter() - self.start:.1f}s")
@@ -0,0 +1,115 @@
+import pandas as pd
+from .aggregation import Incidence
+
+
+# settings a scenario can override. Only the target calculations run per scenario,
+# so settings used by earlier steps (e.g. base_year) need a full run with their own configs
+SCENARIO_SETTINGS = [
+    'targets_end_year',
+    'end_year',
+    'king_gq',
+    'king_hhsz',
+    'king_metro_adj_hhsz',
+    'king_vac',
+    'king_hhpop_2044',
+]
+
+# settings the target calculations read that are the same for every scenario
+SHARED_SETTINGS = ['base_year', 'data_dir', 'output_dir']
+
+
+def apply_overrides(settings, overrides):
+    """
+    Returns a copy of settings with a scenario's overrides applied. Dictionary
+    settings are updated key by key, so a scenario can change a single rgid of
+    king_vac without repeating the others.
+
+    Parameters
+    ----------
+    settings: base settings dictionary
+
+    overrides: dictionary of setting name to value
+    """
+    invalid = [key for key in overrides if key not in SCENARIO_SETTINGS]
+    if invalid:
+        raise ValueError(f"scenarios can only override: {', '.join(SCENARIO_SETTINGS)} "
+                         f"(got {', '.join(invalid)})")
+    settings = dict(settings)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(settings.get(key), dict):
+            settings[key] = {**settings[key], **value}
+        else:
+            settings[key] = value
+    return settings
+
+
+class ScenarioPipeline:
+    """
+    In-memory stand-in for Pipeline used to run the target calculations for
+    one scenario. Tables are read from the inputs shared by every scenario and
+    saved tables are kept in memory, so scenarios don't touch the store and
+    can run in separate processes.
+
+    Parameters
+    ----------
+    scenario_id: name of the scenario
+
+    settings: settings dictionary with the scenario overrides applied
+
+    tables: dictionary of table name to dataframe of the shared inputs
+    """
+    def __init__(self, scenario_id, settings, tables):
+        self.scenario_id = scenario_id
+        self.settings = settings
+        self.tables = dict(tables)
+        self.outputs = {}
+        self._incidences = {}
+
+    def get_data_dir(self):
+        return self.settings.get('data_dir', 'data')
+
+    def get_output_dir(self):
+        return self.settings.get('output_dir', 'output')
+
+    def get_table(self, table_name, columns=None, filters=None):
+        if filters:
+            raise ValueError("ScenarioPipeline.get_table doesn't support filters")
+        df = self.tables[table_name]
+        return df[list(columns)].copy() if columns is not None else df.copy()
+
+    def save_table(self, table_name, df, append=False, data_columns=None):
+        if append and table_name in self.tables:
+            df = pd.concat([self.tables[table_name], df])
+        self.tables[table_name] = df
+        self.outputs[table_name] = df
+
+    def get_incidence(self, table_name, src_col, dst_cols):
+        # same as Pipeline.get_incidence, compiled from the shared input table
+        dst_cols = [dst_cols] if isinstance(dst_cols, str) else list(dst_cols)
+        key = (table_name, src_col, tuple(dst_cols))
+        if key not in self._incidences:
+            df = self.tables[table_name]
+            self._incidences[key] = Incidence(df[src_col], df[dst_cols])
+        return self._incidences[key]
+
+
+def combine_scenario_outputs(outputs):
+    """
+    Returns one table per output name with the outputs of every scenario
+    stacked, keyed by a scenario_id column. Scenarios with different target
+    or end years have different year columns, those are left empty for the
+    other scenarios.
+
+    outputs: dictionary of scenario_id to a dictionary of table name to dataframe
+    """
+    combined = {}
+    for scenario_id, tables in outputs.items():
+        for table_name, df in tables.items():
+            combined.setdefault(table_name, []).append(df.assign(scenario_id=scenario_id))
+    return {
+        table_name: (
+            pd.concat(dfs, ignore_index=True)
+            .pipe(lambda df: df[['scenario_id'] + [c for c in df.columns if c != 'scenario_id']])
+        )
+        for table_name, dfs in combined.items()
+    }
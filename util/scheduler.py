@@ -0,0 +1,102 @@
+import importlib
+import time
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from fnmatch import fnmatch
+from .pipeline import Pipeline
+
+
+def tables_overlap(tables_a, tables_b):
+    # table names can be fnmatch patterns, so check both directions
+    return any(fnmatch(a, b) or fnmatch(b, a) for a in tables_a for b in tables_b)
+
+
+def build_step_graph(step_funcs):
+    """
+    Returns the dependencies of each step, from the tables steps declare they
+    read and write. A step depends on an earlier step in the list if it reads a
+    table the earlier step writes, writes a table the earlier step reads or
+    both write the same table. Steps that don't declare tables depend on every earlier step.
+    """
+    dependencies = {}
+    for j, (name_j, func_j) in enumerate(step_funcs):
+        dependencies[name_j] = set()
+        for name_i, func_i in step_funcs[:j]:
+            declared = (func_i.reads or func_i.writes) and (func_j.reads or func_j.writes)
+            if (not declared
+                    or tables_overlap(func_i.writes, func_j.reads + func_j.writes)
+                    or tables_overlap(func_i.reads, func_j.writes)):
+                dependencies[name_j].add(name_i)
+    return dependencies
+
+
+def get_critical_path(step_names, dependencies, timings):
+    # longest chain of dependent steps by duration, step_names are in run order
+    finish = {}
+    previous = {}
+    for name in step_names:
+        duration = timings[name][1] - timings[name][0]
+        start = max(dependencies[name], key=lambda d: finish[d], default=None)
+        finish[name] = (finish[start] if start else 0) + duration
+        previous[name] = start
+    name = max(finish, key=finish.get)
+    path = []
+    while name:
+        path.insert(0, name)
+        name = previous[name]
+    return path, max(finish.values())
+
+
+def print_timing_summary(step_names, dependencies, timings, run_start):
+    print("\nStep timings (seconds from start of run):")
+    print(f"{'step':<40}{'start':>10}{'end':>10}{'duration':>10}")
+    for name in step_names:
+        start, end = timings[name]
+        print(f"{name:<40}{start - run_start:>10.1f}{end - run_start:>10.1f}{end - start:>10.1f}")
+    path, path_time = get_critical_path(step_names, dependencies, timings)
+    total_time = sum(end - start for start, end in timings.values())
+    wall_time = max(end for _, end in timings.values()) - run_start
+    print(f"\nCritical path ({path_time:.1f}s): {' -> '.join(path)}")
+    print(f"Wall time {wall_time:.1f}s, sum of step times {total_time:.1f}s")
+
+
+def run_steps_parallel(configs_dir, context, max_workers):
+    """
+    Runs the steps in settings.yaml as a dependency graph: each step starts as
+    soon as the steps it depends on have finished, with up to max_workers steps
+    at the same time. All steps share one pipeline, which serializes store access:
+    the run's pipeline if the context has one, otherwise one opened for these steps.
+    """
+    shared = context.get('pipeline')
+    with nullcontext(shared) if shared is not None else Pipeline(settings_path=configs_dir) as p:
+        step_names = list(p.settings.get('steps', []))
+        step_funcs = [(name, importlib.import_module(name).run_step) for name in step_names]
+        dependencies = build_step_graph(step_funcs)
+        funcs = dict(step_funcs)
+
+        context = dict(context, pipeline=p)
+        timings = {}
+        pending = list(step_names)
+        running = {}
+        run_start = time.perf_counter()
+
+        def run_timed(name):
+            start = time.perf_counter()
+            funcs[name](context)
+            timings[name] = (start, time.perf_counter())
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                # start every step whose dependencies have finished
+                for name in list(pending):
+                    if all(d in timings for d in dependencies[name]) and len(running) < max_workers:
+                        pending.remove(name)
+                        running[executor.submit(run_timed, name)] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.pop(future)
+                    # raise step errors right away, steps already running are left to finish
+                    future.result()
+
+        print_timing_summary(step_names, dependencies, timings, run_start)
+    return context
@@ -0,0 +1,120 @@
+from fnmatch import fnmatch
+import numpy as np
+import pandas as pd
+
+
+# compact dtypes a schema can declare for a column
+SCHEMA_DTYPES = ['int', 'category']
+
+INT_DTYPES = ['int8', 'int16', 'int32', 'int64']
+
+
+def get_table_schema(schemas, table_name):
+    """
+    Returns the column dtypes declared for a table. Schema keys can be
+    fnmatch patterns, columns from every matching key are combined.
+
+    Parameters
+    ----------
+    schemas: table_schemas dictionary from settings.yaml
+
+    table_name: name of the table in the store
+    """
+    schema = {}
+    for pattern, columns in (schemas or {}).items():
+        if fnmatch(table_name, pattern):
+            for col, dtype in columns.items():
+                if dtype not in SCHEMA_DTYPES:
+                    raise ValueError(f"table_schemas {pattern}.{col} must be one of: {', '.join(SCHEMA_DTYPES)}")
+                schema[col] = dtype
+    return schema
+
+
+def smallest_int_dtype(values):
+    # smallest signed integer dtype that holds every value
+    if len(values) == 0:
+        return 'int64'
+    low, high = values.min(), values.max()
+    for dtype in INT_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return 'int64'
+
+
+def compact_dtypes(df, schema):
+    """
+    Returns a dataframe with the schema applied: 'int' columns are downcast to the
+    smallest integer type that fits their values and 'category' columns become
+    categoricals. Columns that aren't in the table or can't be converted safely
+    (e.g. 'int' columns with missing values) are left as they are.
+    """
+    converted = {}
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        values = df[col]
+        if dtype == 'int' and pd.api.types.is_integer_dtype(values):
+            converted[col] = values.astype(smallest_int_dtype(values))
+        elif dtype == 'category' and not isinstance(values.dtype, pd.CategoricalDtype):
+            converted[col] = values.astype('category')
+    return df.assign(**converted) if converted else df
+
+
+def restore_dtypes(df, schema):
+    """
+    Converts the schema columns of a table read from the store back to the dtypes
+    the steps work with, in place: 'int' columns to int64 and categoricals to the dtype
+    of their categories. Compact dtypes only change how tables are stored, not results.
+    """
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        values = df[col]
+        if dtype == 'int' and pd.api.types.is_integer_dtype(values) and values.dtype != 'int64':
+            df[col] = values.astype('int64')
+        elif dtype == 'category' and isinstance(values.dtype, pd.CategoricalDtype):
+            target = values.cat.categories.dtype
+            if pd.api.types.is_integer_dtype(target) and values.isna().any():
+                # integers with missing values are floats outside a categorical
+                target = 'float64'
+            df[col] = values.astype(target)
+    return df
+
+
+def match_dtypes(df, dtypes, table_name):
+    """
+    Returns a dataframe of rows appended to a stored table with its columns converted
+    to the dtypes the table was stored with: integers to the stored integer type and
+    categoricals to the stored categories. Raises an error for values that don't fit,
+    since the store can't widen the columns of an existing table.
+
+    Parameters
+    ----------
+    df: rows to append
+
+    dtypes: dictionary of column to stored dtype, for the table's schema columns
+
+    table_name: name of the table, for the error message
+    """
+    converted = {}
+    for col, dtype in dtypes.items():
+        if col not in df.columns:
+            continue
+        values = df[col]
+        if isinstance(dtype, pd.CategoricalDtype):
+            matched = values.astype(dtype)
+            fits = not (matched.isna() & values.notna()).any()
+        elif pd.api.types.is_integer_dtype(dtype) and pd.api.types.is_integer_dtype(values):
+            info = np.iinfo(dtype)
+            fits = len(values) == 0 or (info.min <= values.min() and values.max() <= info.max)
+            matched = values.astype(dtype) if fits else values
+        else:
+            continue
+        if not fits:
+            raise ValueError(
+                f"{col} values appended to {table_name} don't fit the {dtype} it was stored with, "
+                f"leave {col} out of the table's entry in table_schemas"
+            )
+        converted[col] = matched
+    return df.assign(**converted) if converted else df
@@ -0,0 +1,121 @@
+import functools
+from .pipeline import Pipeline
+
+
+def short_step_name(step_name):
+    # 'steps.load_data' and 'load_data' both refer to the same step
+    return step_name.split('.')[-1]
+
+
+def get_run_reason(pipeline, step_name, context, writes=()):
+    """
+    Returns why a step should run, or None if it should be skipped.
+
+    Steps listed with --only always run and every other step is skipped.
+    With --from-step, steps before it are skipped and it and every later step run.
+    Otherwise a step runs if --force is set, any of its inputs changed or any
+    of its outputs is missing from the store. writes are the tables the step
+    declares, patterns like 'ofm_estimates_*' are only checked through the manifest.
+    """
+    name = short_step_name(step_name)
+    only_steps = [short_step_name(s) for s in context.get('only_steps') or []]
+    if only_steps:
+        return 'selected with --only' if name in only_steps else None
+
+    from_step = context.get('from_step')
+    if from_step:
+        steps = [short_step_name(s) for s in pipeline.settings.get('steps', [])]
+        if short_step_name(from_step) not in steps:
+            raise ValueError(f"--from-step {from_step} is not in the steps list in settings.yaml")
+        if steps.index(name) < steps.index(short_step_name(from_step)):
+            return None
+        return 'at or after --from-step'
+
+    if context.get('force'):
+        return 'forced with --force'
+
+    step = pipeline.manifest.steps.get(step_name)
+    if step is None:
+        return 'no previous run'
+    declared = [table for table in writes if not any(c in table for c in '*?[')]
+    if not all(pipeline.table_exists(table) for table in step['writes'] + declared):
+        return 'outputs missing from the store'
+    if not pipeline.manifest.is_step_current(step_name, pipeline.settings):
+        return 'inputs or settings changed'
+    return None
+
+
+def run_recorded(pipeline, func, step_name):
+    # runs a step function and saves what it used to the manifest
+    p = pipeline
+    p.start_step_record()
+    func(p)
+    p.end_step_record(step_name)
+
+
+def run_profiled(pipeline, func, step_name, reason, report):
+    # runs a step function with its time, memory and table reads/writes added to the run report
+    p = pipeline
+    profile = report.start_step(step_name, p.get_output_dir())
+    profile.reason = reason
+    p.step_profile = profile
+    profiler = report.start_profiler()
+    status = 'failed'
+    try:
+        run_recorded(p, func, step_name)
+        status = 'done'
+    finally:
+        report.stop_profiler(profiler, step_name)
+        profile.finish(status)
+        p.step_profile = None
+
+
+def pipeline_step(func=None, reads=(), writes=()):
+    """
+    Turns a function that takes a Pipeline into a pypyr run_step(context).
+    The step is skipped if the tables, input files and settings it used last time
+    are unchanged, otherwise it runs and what it used is saved to the manifest.
+
+    Parameters
+    ----------
+    reads: names of the tables the step reads, fnmatch patterns like 
+            'ofm_estimates_*' are allowed
+
+    writes: names of the tables the step writes
+
+    reads and writes are used by the scheduler to find steps that can run in parallel.
+    If the context has a 'pipeline' it is shared with the other steps of the run,
+    otherwise the step opens its own pipeline. If the context has a 'run_report',
+    the step's time, memory and table reads/writes are added to it.
+    """
+    if func is None:
+        return functools.partial(pipeline_step, reads=reads, writes=writes)
+
+    step_name = func.__module__
+
+    @functools.wraps(func)
+    def run_step(context):
+        shared = context.get('pipeline')
+        report = context.get('run_report')
+        p = shared or Pipeline(settings_path=context['configs_dir'])
+        try:
+            reason = get_run_reason(p, step_name, context, writes)
+            if reason is None:
+                print(f"Skipping {step_name}: inputs unchanged or not selected, using stored outputs")
+                if report is not None:
+                    report.skip_step(step_name, p.get_output_dir())
+                return context
+            print(f"Running {step_name} ({reason})")
+            if report is not None:
+                run_profiled(p, func, step_name, reason, report)
+            else:
+                run_recorded(p, func, step_name)
+        finally:
+            if shared is None:
+                p.close()
+        return context
+
+    run_step.step_name = step_name
+    run_step.reads = list(reads)
+    run_step.writes = list(writes)
+    return run_step
@@ -0,0 +1,270 @@
+import os
+import shutil
+import pandas as pd
+
+
+# filter ops that can be applied by PyTables while reading
+WHERE_OPS = {'==': '==', '=': '==', '!=': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>=', 'in': 'in'}
+
+FILTER_OPS = {
+    '==': lambda s, v: s == v,
+    '=': lambda s, v: s == v,
+    '!=': lambda s, v: s != v,
+    '<': lambda s, v: s < v,
+    '<=': lambda s, v: s <= v,
+    '>': lambda s, v: s > v,
+    '>=': lambda s, v: s >= v,
+    'in': lambda s, v: s.isin(v),
+    'not in': lambda s, v: ~s.isin(v),
+}
+
+
+def get_storage_backend(name, data_dir):
+    """
+    Returns the storage backend used by the pipeline store.
+
+    Parameters
+    ----------
+    name: 'hdf5' (default) or 'parquet'
+
+    data_dir: directory the store is written to
+    """
+    if name == 'hdf5':
+        return HDF5Backend(data_dir)
+    elif name == 'parquet':
+        return ParquetBackend(data_dir)
+    else:
+        raise ValueError("storage_backend must be: 'hdf5' or 'parquet'")
+
+
+def filter_columns(filters):
+    # Returns the column names used in a list of (column, op, value) filters
+    return [col for col, _, _ in filters or []]
+
+
+def string_itemsize(df, factor=2):
+    # Returns min_itemsize for the string columns of a dataframe, with room to grow
+    itemsize = {}
+    for col in df.select_dtypes(include='object').columns:
+        max_len = df[col].str.len().max()
+        if pd.notna(max_len):
+            itemsize[col] = int(max_len * factor)
+    return itemsize
+
+
+def where_value(value):
+    # numpy scalars are converted so their repr can be parsed in a PyTables where expression
+    if isinstance(value, (list, tuple, set)) or getattr(value, 'ndim', 0) > 0:
+        return [where_value(v) for v in value]
+    return value.item() if hasattr(value, 'item') else value
+
+
+def filter_mask(df, filters):
+    # Returns a boolean series of the rows that pass a list of (column, op, value) filters
+    mask = pd.Series(True, index=df.index)
+    for col, op, value in filters:
+        if op not in FILTER_OPS:
+            raise ValueError(f"filter op must be one of: {', '.join(FILTER_OPS)}")
+        mask &= FILTER_OPS[op](df[col], value)
+    return mask
+
+
+def apply_filters(df, filters):
+    """
+    Applies a list of (column, op, value) row filters to a dataframe.
+    Uses the same filter format as pyarrow/pd.read_parquet.
+    """
+    if not filters:
+        return df
+    return df[filter_mask(df, filters)]
+
+
+class HDF5Backend:
+    """
+    Stores every table in a single PyTables HDF5 file (data/pipeline.h5).
+    The file handle is opened on first use and kept open until close().
+    """
+    name = 'hdf5'
+    binary_geometry = False
+
+    def __init__(self, data_dir):
+        self.path = f"{data_dir}/pipeline.h5"
+        self._h5store = None
+
+    def open(self):
+        if self._h5store is None or not self._h5store.is_open:
+            self._h5store = pd.HDFStore(self.path, mode='a')
+        return self._h5store
+
+    def close(self):
+        if self._h5store is not None:
+            self._h5store.close()
+            self._h5store = None
+
+    def exists(self, table_name):
+        return f"/{table_name}" in self.open().keys()
+
+    def get_columns(self, table_name):
+        # reads zero rows to get the column names without loading the table
+        return list(self.open().select(table_name, start=0, stop=0).columns)
+
+    def head(self, table_name, columns=None, n=1000):
+        return self.open().select(table_name, columns=columns, start=0, stop=n)
+
+    def iter_chunks(self, table_name, columns=None, chunksize=100000):
+        # yields the table in chunks of rows, only one chunk is read into memory at a time
+        return iter(self.open().select(table_name, columns=columns, chunksize=chunksize))
+
+    def split_filters(self, table_name, filters):
+        """
+        Splits filters into a PyTables where expression for filters on the table's
+        data columns, which are applied while reading, and the remaining filters.
+        """
+        if not filters:
+            return None, filters
+        data_columns = self.open().get_storer(table_name).data_columns or []
+        where = []
+        remaining = []
+        for col, op, value in filters:
+            if col in data_columns and op in WHERE_OPS:
+                where.append(f"{col} {WHERE_OPS[op]} {where_value(value)!r}")
+            else:
+                remaining.append((col, op, value))
+        return where or None, remaining
+
+    def get(self, table_name, columns=None, filters=None):
+        where, filters = self.split_filters(table_name, filters)
+        if columns is None:
+            df = self.open().select(table_name, where=where) if where else self.open().get(table_name)
+            return apply_filters(df, filters)
+
+        # read filter columns along with the requested columns, then drop them
+        read_cols = list(dict.fromkeys(list(columns) + filter_columns(filters)))
+        df = self.open().select(table_name, where=where, columns=read_cols)
+        return apply_filters(df, filters)[list(columns)]
+
+    def put(self, table_name, df, data_columns=None, min_itemsize=None):
+        """
+        Writes a table, replacing it if it exists. Data columns are indexed by PyTables
+        so filters on them only read matching rows. Pass min_itemsize (a dictionary of
+        column to string size, can be empty) for tables that rows will be appended to:
+        string columns are then sized at twice their longest value, or the given size.
+        """
+        if min_itemsize is not None:
+            min_itemsize = {**string_itemsize(df), **min_itemsize}
+        self.open().put(table_name, df, format='table', data_columns=data_columns,
+                        min_itemsize=min_itemsize)
+
+    def append(self, table_name, df, min_itemsize=None):
+        """
+        Appends rows to a table, creating it if needed. String column sizes are fixed
+        when the table is created (see put), appending longer strings raises an error
+        rather than rewriting the whole table.
+        """
+        store = self.open()
+        if not self.exists(table_name):
+            store.append(table_name, df, format='table',
+                         min_itemsize={**string_itemsize(df), **(min_itemsize or {})})
+            return
+        try:
+            store.append(table_name, df, format='table')
+        except ValueError as e:
+            # other errors, e.g. a column dtype that doesn't match the table, are raised as they are
+            if 'Trying to store a string with len' not in str(e):
+                raise
+            raise ValueError(
+                f"Rows appended to {table_name} have longer strings than the table was created for, "
+                f"set min_itemsize for the columns when the table is first saved "
+                f"(e.g. min_itemsize on the layer in settings.yaml)"
+            ) from e
+
+
+class ParquetBackend:
+    """
+    Stores each table as a Parquet file under data/pipeline_parquet.
+    Column projection and row filters are pushed down to pyarrow, so only
+    the needed columns and row groups are read.
+    """
+    name = 'parquet'
+    binary_geometry = True
+
+    def __init__(self, data_dir):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            raise ImportError(
+                "storage_backend: parquet requires pyarrow (pip install pyarrow)"
+            ) from e
+        self.path = f"{data_dir}/pipeline_parquet"
+        os.makedirs(self.path, exist_ok=True)
+
+    def open(self):
+        return self
+
+    def close(self):
+        pass
+
+    def table_path(self, table_name):
+        return f"{self.path}/{table_name}.parquet"
+
+    def exists(self, table_name):
+        return os.path.exists(self.table_path(table_name))
+
+    def get_columns(self, table_name):
+        import pyarrow.dataset as ds
+        names = ds.dataset(self.table_path(table_name)).schema.names
+        return [name for name in names if not name.startswith('__index_level_')]
+
+    def head(self, table_name, columns=None, n=1000):
+        import pyarrow.dataset as ds
+        columns = list(columns) if columns is not None else self.get_columns(table_name)
+        return ds.dataset(self.table_path(table_name)).head(n, columns=columns).to_pandas()
+
+    def iter_chunks(self, table_name, columns=None, chunksize=100000):
+        # yields the table in record batches of at most chunksize rows,
+        # only one batch is read into memory at a time
+        import pyarrow.dataset as ds
+        columns = list(columns) if columns is not None else self.get_columns(table_name)
+        dataset = ds.dataset(self.table_path(table_name))
+        for batch in dataset.to_batches(columns=columns, batch_size=chunksize):
+            yield batch.to_pandas()
+
+    def get(self, table_name, columns=None, filters=None):
+        if not self.exists(table_name):
+            raise KeyError(f"No object named {table_name} in the parquet store")
+        return pd.read_parquet(
+            self.table_path(table_name),
+            columns=list(columns) if columns is not None else None,
+            filters=filters or None,
+        )
+
+    def remove(self, table_name):
+        path = self.table_path(table_name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def put(self, table_name, df, data_columns=None, min_itemsize=None):
+        # min_itemsize is only used by the HDF5 backend, parquet strings have no fixed size.
+        # tables with data columns are written in smaller row groups, so filters on a
+        # sorted data column skip the row groups that can't match using their statistics
+        self.remove(table_name)
+        row_group_size = 65536 if data_columns else None
+        df.to_parquet(self.table_path(table_name), row_group_size=row_group_size)
+
+    def append(self, table_name, df, min_itemsize=None):
+        """
+        Appends rows to a table by writing them as a new part file. Appended tables
+        are stored as a directory of parts that pyarrow reads as one dataset.
+        """
+        path = self.table_path(table_name)
+        if os.path.isfile(path):
+            # move a single file table into a dataset directory
+            tmp_path = f"{path}.tmp"
+            os.rename(path, tmp_path)
+            os.makedirs(path)
+            os.rename(tmp_path, f"{path}/part-00000.parquet")
+        os.makedirs(path, exist_ok=True)
+        part = len(os.listdir(path))
+        df.to_parquet(f"{path}/part-{part:05d}.parquet", index=False)
@@ -1,19 +1,18 @@
 # shared calculations for units change and population change targets
+import numpy as np
+import pandas as pd
+
 
 def load_input_tables(pipeline,targets_type):
     # targets type: 'units' or 'total_pop'
 
     p = pipeline
-    # load control to target lookup
-    control_target_lookup = p.get_table('control_target_lookup')
+    # control to target lookup compiled to index arrays
+    lookup = p.get_incidence('control_target_lookup', 'control_id', ['target_id','RGID','county_id'])
 
     # sum decennial data to target areas
-    dec = (
-        p.get_table('decennial_by_control_area')
-        .merge(control_target_lookup, on='control_id', how='left')
-        .groupby(['target_id','RGID','county_id']).sum().reset_index()
-        .drop(columns=['control_id','name'])
-    )
+    decennial = p.get_table('decennial_by_control_area')
+    dec = lookup.aggregate(decennial['control_id'], decennial.drop(columns='control_id'))
 
     # merge decennial data with adjusted targets
     df = (
@@ -43,7 +42,131 @@ def calc_gq(pipeline, df, dec, horizon_year):
     reg_dec_gq_sum = dec['dec_gq'].sum()
     df['dec_gq_pct'] = df['dec_gq'] / reg_dec_gq_sum
 
-    # calculate target area GQ for horizon year as a percentage of the regional GQ from REF
+    # calculate target area GQ for horizon year as a percentage of the regional GQ from REF.
+    # balanced over every target area in the region (not just the ones in df), so the units
+    # and population targets together add up exactly to the regional GQ. Areas are balanced in
+    # target_id order, like the annual series, so ties are rounded the same way in both
     gq_horizon_col = f'gq_{horizon_year}'
-    df[gq_horizon_col] = (df['dec_gq_pct'] * reg_gq_horizon).round(0).astype(int)
-    return df
\ No newline at end of file
+    dec = dec.sort_values('target_id')
+    reg_gq = balance_to_controls(dec, ['dec_gq'], [(None, reg_gq_horizon)])['dec_gq']
+    df[gq_horizon_col] = df['target_id'].map(pd.Series(reg_gq.to_numpy(), index=dec['target_id'])).astype(int)
+    return df
+
+
+def group_sums(codes, values, n_groups):
+    # sums of each column of a 2d array by group code, rows with code -1 are left out
+    matched = codes >= 0
+    return np.column_stack([
+        np.bincount(codes[matched], weights=values[matched, j], minlength=n_groups)
+        for j in range(values.shape[1])
+    ])
+
+
+def ipf(values, controls, max_iterations=100, tolerance=1e-9):
+    """
+    Iterative proportional fitting: scales values until their sums by group
+    match every control, one control at a time. Groups with a seed sum of 0
+    can't be scaled and are left at 0.
+
+    Parameters
+    ----------
+    values: 2d array of seed values, one row per area and one column per measure
+
+    controls: list of (codes, totals), codes is the group of each area (-1 for areas
+            the control doesn't cover) and totals has one row per group
+
+    max_iterations: passes over the controls before giving up on converging
+
+    tolerance: largest relative change of any group in a pass at which the fit has converged
+    """
+    values = np.array(values, dtype='float64')
+    for _ in range(max_iterations):
+        max_change = 0.0
+        for codes, totals in controls:
+            sums = group_sums(codes, values, len(totals))
+            factors = np.divide(totals, sums, out=np.ones_like(sums), where=sums > 0)
+            matched = codes >= 0
+            values[matched] *= factors[codes[matched]]
+            max_change = max(max_change, np.abs(factors - 1).max(initial=0.0))
+        if max_change <= tolerance:
+            break
+    return values
+
+
+def integerize(values, codes, totals):
+    """
+    Rounds values to integers that add up exactly to the total of their group
+    with the largest remainder method: values are scaled to their group total and
+    rounded down, then the missing units go to the areas with the largest fractional
+    parts. Ties go to the area that comes first, so results are the same on every run.
+
+    Parameters
+    ----------
+    values: 2d array of non-negative values, one row per area and one column per measure
+
+    codes: group of each area, every area must be in a group
+
+    totals: integer totals, one row per group. Groups with a sum of 0 are left at 0
+    """
+    n_groups = len(totals)
+    sums = group_sums(codes, values, n_groups)
+    factors = np.divide(totals, sums, out=np.zeros_like(sums), where=sums > 0)
+    values = values * factors[codes]
+    floors = np.floor(values)
+    remainders = values - floors
+    result = floors.astype('int64')
+
+    # units each group is missing after rounding down, always fewer than its number of areas
+    deficit = np.rint(totals).astype('int64') - np.rint(group_sums(codes, floors, n_groups)).astype('int64')
+    deficit[sums <= 0] = 0
+    positions = np.arange(len(values))
+    for j in range(values.shape[1]):
+        # areas sorted by group, then largest remainder, then position
+        order = np.lexsort((positions, -remainders[:, j], codes))
+        sorted_codes = codes[order]
+        rank = positions - np.searchsorted(sorted_codes, sorted_codes, side='left')
+        result[order[rank < deficit[sorted_codes, j]], j] += 1
+    return result
+
+
+def balance_to_controls(df, value_cols, controls, max_iterations=100, tolerance=1e-9):
+    """
+    Returns integer values of value_cols balanced to every control: scaled with
+    iterative proportional fitting, then rounded with the largest remainder method
+    so they add up exactly to the last control (and every control it nests in).
+
+    Parameters
+    ----------
+    df: table with one row per area
+
+    value_cols: list of seed value columns, each is balanced on its own
+
+    controls: list of (key_col, totals) from the broadest to the most detailed control,
+            e.g. [(None, regional_total), ('county_id', county_totals), ('RGID', rgid_totals)].
+            A key_col of None is a single total for every area, otherwise totals is a
+            series (or a dataframe with value_cols) indexed by the values of key_col
+
+    max_iterations: see ipf
+
+    tolerance: see ipf
+    """
+    n_cols = len(value_cols)
+    arrays = []
+    for key_col, totals in controls:
+        if key_col is None:
+            codes = np.zeros(len(df), dtype='int64')
+            totals = np.asarray(totals, dtype='float64').reshape(1, -1)
+        else:
+            if isinstance(totals, pd.DataFrame):
+                totals = totals[value_cols]
+            codes = pd.Index(totals.index).get_indexer(df[key_col])
+            totals = np.asarray(totals, dtype='float64').reshape(len(totals), -1)
+        arrays.append((codes, np.broadcast_to(totals, (len(totals), n_cols))))
+
+    key_col, _ = controls[-1]
+    codes, totals = arrays[-1]
+    if (codes < 0).any():
+        raise ValueError(f"{key_col} values in the table are missing from the control totals")
+
+    values = ipf(df[value_cols].to_numpy(dtype='float64'), arrays, max_iterations, tolerance)
+    return pd.DataFrame(integerize(values, codes, totals), columns=value_cols, index=df.index)
\ No newline at end of file